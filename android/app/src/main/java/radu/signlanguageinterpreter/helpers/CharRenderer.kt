@@ -127,9 +127,9 @@ class CharRenderer(
         }
 
         private fun getQuats(offset: Int): Map<String, Quaternion> {
-            val landmarks = LandmarksLoader.load(offset)
+            val frame = LandmarksLoader.load(offset)
 
-            if (landmarks == null) {
+            if (frame == null) {
                 if (tsSpeechStopped == 0L) {
                     tsSpeechStopped = System.nanoTime()
                 }
@@ -148,11 +148,14 @@ class CharRenderer(
             }
 
             tsSpeechStopped = 0L
-            return skeleton.getBonesRotations(landmarks)
+            return frame.rotations?.let { skeleton.mapRotations(it) }
+                ?: skeleton.getBonesRotations(frame.landmarks!!)
         }
     }
 
     init {
+        LandmarksLoader.skeleton = skeleton
+
         viewerContent.view = modelViewer.view
         viewerContent.sunlight = modelViewer.light
         viewerContent.lightManager = modelViewer.engine.lightManager
@@ -220,6 +223,8 @@ class CharRenderer(
     fun changeChar(newCharPath: String) {
         charPath = newCharPath
         skeleton = Skeleton(charPath)
+        LandmarksLoader.skeleton = skeleton
+        LandmarksLoader.reload()
         loadModel()
     }
 
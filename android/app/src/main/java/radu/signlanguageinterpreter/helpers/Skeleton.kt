@@ -12,10 +12,14 @@ class Skeleton(charPath: String) {
         val DEFAULT: Skeleton
 
         private val pySkeletonModule = Python.getInstance().getModule("skeleton")
-        private val pyCalcRFunction = Python.getInstance().getModule("calc_R")["calc_R"]!!
+        private val pyCalcRModule = Python.getInstance().getModule("calc_R")
 
         private val nullLmQuat = Quaternion(0f, 0f, 0.5f, 0f)
 
+        // Parsed skeletons are cached here, so the GLB is only parsed once per version
+        private val rigCacheDirPath =
+            Application.context.cacheDir.absolutePath + File.separator + "rig"
+
         private val boneIndexesMap: Array<String>
 
         init {
@@ -34,10 +38,18 @@ class Skeleton(charPath: String) {
     }
 
     private val pySkeletonClassInstance: PyObject
+    private val pyIKSolverInstance: PyObject
     private val boneNamesMap: Map<String, String>
 
+    val charName = File(charPath).nameWithoutExtension
+
+    // Identifies the rig the baked rotations must have been solved for
+    val rigDigest: PyObject
+
     init {
-        pySkeletonClassInstance = pySkeletonModule.callAttr("Skeleton", charPath)
+        pySkeletonClassInstance = pySkeletonModule.callAttr("Skeleton", charPath, rigCacheDirPath)
+        pyIKSolverInstance = pyCalcRModule.callAttr("IKSolver", pySkeletonClassInstance)
+        rigDigest = pySkeletonClassInstance["rig_digest"]!!
         boneNamesMap =
             pySkeletonClassInstance["_bone_names_map"]!!.asMap().entries.associate { (key, value) ->
                     key.toString() to value.toString()
@@ -45,12 +57,11 @@ class Skeleton(charPath: String) {
     }
 
     fun getBonesRotations(landmarks: Map<String, Array<FloatArray>>): Map<String, Quaternion> {
-        return pyCalcRFunction.call(
-            pySkeletonClassInstance,
-            landmarks["pose"]!!,
-            landmarks["left_hand"]!!,
-            landmarks["right_hand"]!!
-        ).toJava(Array<FloatArray>::class.java).mapIndexed { index, value ->
+        return mapRotations(getBonesRotationsArray(landmarks))
+    }
+
+    fun mapRotations(rotations: Array<FloatArray>): Map<String, Quaternion> {
+        return rotations.mapIndexed { index, value ->
                 getMappedName(index) to Quaternion(
                     value[1], value[2], value[3], value[0]
                 )
@@ -60,8 +71,8 @@ class Skeleton(charPath: String) {
     }
 
     fun getBonesRotationsArray(landmarks: Map<String, Array<FloatArray>>): Array<FloatArray> {
-        return pyCalcRFunction.call(
-            pySkeletonClassInstance,
+        return pyIKSolverInstance.callAttr(
+            "solve",
             landmarks["pose"]!!,
             landmarks["left_hand"]!!,
             landmarks["right_hand"]!!
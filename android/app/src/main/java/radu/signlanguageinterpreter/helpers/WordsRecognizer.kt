@@ -19,6 +19,7 @@ import radu.signlanguageinterpreter.globals.postDelayed
 import radu.signlanguageinterpreter.globals.showDialogAndExit
 import radu.signlanguageinterpreter.io.HttpClient
 import java.util.LinkedList
+import java.util.UUID
 import java.util.concurrent.atomic.AtomicBoolean
 import java.util.concurrent.atomic.AtomicInteger
 import java.util.concurrent.locks.ReentrantLock
@@ -38,13 +39,16 @@ class WordsRecognizer(private val activity: Activity) {
     private val processThenClearWords = Runnable {
         lock.lock()
         try {
-            processWords(words.toList(), true)
+            processWords(words.toList(), true, sessionId)
             words.clear()
+            sessionId = UUID.randomUUID().toString()
         } finally {
             lock.unlock()
         }
     }
 
+    // Sent with every request of an utterance, so that the server only parses its end
+    private var sessionId = UUID.randomUUID().toString()
     private var endResultRunnable: Runnable? = null
     private var recognizer: SpeechRecognizer? = null
 
@@ -98,7 +102,7 @@ class WordsRecognizer(private val activity: Activity) {
                         if (endResultRunnable != null) {
                             delayHandler.removeCallbacks(endResultRunnable!!)
                             if (words.size >= 3) {
-                                processWords(words.toList(), false)
+                                processWords(words.toList(), false, sessionId)
                             }
                         }
 
@@ -123,7 +127,7 @@ class WordsRecognizer(private val activity: Activity) {
         recognizer = null
     }
 
-    private fun processWords(currentWords: List<String>, isEnd: Boolean) =
+    private fun processWords(currentWords: List<String>, isEnd: Boolean, sessionId: String) =
         CoroutineScope(Dispatchers.IO).launch {
             if (networkError.get() || currentWords.isEmpty() || currentWords.all { it.isEmpty() }) {
                 return@launch
@@ -134,7 +138,7 @@ class WordsRecognizer(private val activity: Activity) {
             val requestId = requestCounter.getAndIncrement()
             val result = HttpClient.post(
                 "nlp/sentence", object : TypeToken<List<List<String>>>() {}, mapOf(
-                    "sentence" to currentWords.joinToString(" "), "isEnd" to isEnd
+                    "sentence" to currentWords.joinToString(" "), "isEnd" to isEnd, "sessionId" to sessionId
                 )
             )
 
@@ -3,31 +3,49 @@
 package radu.signlanguageinterpreter.io
 
 import android.util.Log
+import com.chaquo.python.Kwarg
 import com.chaquo.python.Python
-import org.jetbrains.bio.npy.NpyFile
 import radu.signlanguageinterpreter.Application
 import radu.signlanguageinterpreter.globals.SharedState
+import radu.signlanguageinterpreter.helpers.Skeleton
 import java.io.File
-import java.nio.file.Paths
+
+// A frame of a word, either its bone rotations, when they were baked for the word, the window
+// size and the skeleton, or else its landmarks, to solve the rotations from
+class Frame(val landmarks: Map<String, Array<FloatArray>>?, val rotations: Array<FloatArray>?)
 
 object LandmarksLoader {
     private val landmarksPath =
         Application.dataDirPath + File.separator + "landmark" + File.separator
 
-    private val pySaveSmoothedFunction =
-        Python.getInstance().getModule("helpers.landmarks_smoother")["save_smoothed"]!!
+    // Baked by library/bake_rotations.py, in a directory per character
+    private val rotationsPath =
+        Application.dataDirPath + File.separator + "rotation" + File.separator
+
+    private val pyGetSmoothedFunction =
+        Python.getInstance().getModule("helpers.landmarks_smoother")["get_smoothed"]!!
+
+    private val pyLandmarksDigestFunction =
+        Python.getInstance().getModule("helpers.landmarks_smoother")["landmarks_digest"]!!
+
+    private val pyGetBakedRotationsFunction =
+        Python.getInstance().getModule("helpers.rotation_clip")["get_baked_rotations"]!!
+
+    // The skeleton being animated, whose baked rotations are used when there are some
+    var skeleton: Skeleton? = null
 
     private var prevWord: String? = null
     private var word: String? = null
     private var landmarks: Map<String, Array<Array<FloatArray>>>? = null
+    private var rotations: Array<Array<FloatArray>>? = null
     private var curFrame = 0
     private var numFrames = 0
     private var accumulatedNumFrames = 0
 
-    fun load(offsetFrames: Int): Map<String, Array<FloatArray>>? {
+    fun load(offsetFrames: Int): Frame? {
         curFrame += offsetFrames
 
-        if (landmarks == null || curFrame >= accumulatedNumFrames) {
+        if ((landmarks == null && rotations == null) || curFrame >= accumulatedNumFrames) {
             val newWord = SharedState.wordsQueue.poll()
 
             if (newWord == null || newWord == word) {
@@ -43,8 +61,14 @@ object LandmarksLoader {
             prevWord = word
         }
 
-        return landmarks?.mapValues {
-            it.value[curFrame - (accumulatedNumFrames - numFrames)]
+        val index = curFrame - (accumulatedNumFrames - numFrames)
+
+        rotations?.let {
+            return Frame(null, it[index])
+        }
+
+        return landmarks?.let {
+            Frame(it.mapValues { entry -> entry.value[index] }, null)
         }
     }
 
@@ -54,9 +78,18 @@ object LandmarksLoader {
 
     private fun reload(newLandmarks: Boolean) {
         try {
-            val fps = pySaveSmoothedFunction.call(
-                landmarksPath, word, SharedState.selectedWindowSize
-            ).toInt()
+            // Baked rotations are only used if they were solved from the word's current landmarks
+            val baked = skeleton?.let {
+                pyGetBakedRotationsFunction.call(
+                    rotationsPath + it.charName, word, SharedState.selectedWindowSize, it.rigDigest,
+                    pyLandmarksDigestFunction.call(landmarksPath, word)
+                )
+            }?.asList()
+            // With the same steady state Kalman filter the rotations are baked from
+            val smoothed = baked ?: pyGetSmoothedFunction.call(
+                landmarksPath, word, SharedState.selectedWindowSize, Kwarg("steady_state", true)
+            ).asList()
+            val fps = smoothed[0].toInt()
 
             // If the current word is actually a letter, part of a bigger word, animate it faster
             if (word!!.length == 1 && (prevWord?.length == 1 || SharedState.wordsQueue.peek()?.length == 1)) {
@@ -65,8 +98,24 @@ object LandmarksLoader {
                 SharedState.currentLandmarkFps = fps
             }
 
-            val path = landmarksPath + word + "_smooth.npy"
-            val npyArray = NpyFile.read(Paths.get(path)).asFloatArray()
+            val npyArray = smoothed[1].callAttr("ravel").toJava(FloatArray::class.java)
+
+            if (baked != null) {
+                numFrames = npyArray.size / (41 * 4)
+                if (newLandmarks) {
+                    accumulatedNumFrames += numFrames
+                }
+
+                rotations = Array(numFrames) { frame ->
+                    Array(41) { bone ->
+                        val offset = (frame * 41 + bone) * 4
+                        npyArray.copyOfRange(offset, offset + 4)
+                    }
+                }
+                landmarks = null
+
+                return
+            }
 
             numFrames = npyArray.size / (3 * 33 * 3)
             if (newLandmarks) {
@@ -95,8 +144,10 @@ object LandmarksLoader {
             val rh = lms[2]
 
             landmarks = mapOf("pose" to pose, "left_hand" to lh, "right_hand" to rh)
+            rotations = null
         } catch (_: Exception) {
             landmarks = null
+            rotations = null
         }
     }
 }
\ No newline at end of file
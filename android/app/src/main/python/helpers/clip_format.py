@@ -0,0 +1,239 @@
+import numpy as np
+import os
+import re
+import struct
+
+from .math_types import *
+
+
+# A clip file is a 64 bytes header followed by the (T, 75, 3) landmarks, frame after frame:
+# the 33 of the pose, then the 21 of each hand, as float32 or as int16 quantized per axis.
+#
+# Header, little endian:
+#   magic, version, dtype (0 float32, 1 int16), fps, number of frames,
+#   [start, stop) of the frames with a left hand, then a right one,
+#   scale per axis of the int16 values, 1 for float32.
+_magic = b'LSCL'
+_version = 1
+_header = struct.Struct('<4sHHHxxI4I3f')
+_header_size = 64
+
+dtypes = [np.dtype('<f4'), np.dtype('<i2')]
+
+_num_pose_landmarks = 33
+_num_hand_landmarks = 21
+num_landmarks = _num_pose_landmarks + 2 * _num_hand_landmarks
+
+clip_extension = '.clip'
+
+
+def _presence_range(hand: VecNxNx3) -> tuple[int, int]:
+    present = hand.any(axis=(1, 2))
+
+    if not present.any():
+        return (0, 0)
+
+    return (int(np.argmax(present)), len(present) - int(np.argmax(present[::-1])))
+
+
+def pack(frames: VecNxNxNx3) -> VecNxNx3:
+    """
+    Packs legacy (3, T, 33, 3) landmarks, whose hands are padded to 33 landmarks, into (T, 75, 3).
+    """
+
+    packed = np.empty((frames.shape[1], num_landmarks, 3), dtype=np.float32)
+    packed[:, :_num_pose_landmarks] = frames[0]
+    packed[:, _num_pose_landmarks:-_num_hand_landmarks] = frames[1, :, :_num_hand_landmarks]
+    packed[:, -_num_hand_landmarks:] = frames[2, :, :_num_hand_landmarks]
+
+    return packed
+
+
+def unpack(packed: VecNxNx3) -> VecNxNxNx3:
+    """
+    The inverse of pack, with the hands padded with zeros again.
+    """
+
+    frames = np.zeros((3, len(packed), _num_pose_landmarks, 3), dtype=np.float32)
+    frames[0] = packed[:, :_num_pose_landmarks]
+    frames[1, :, :_num_hand_landmarks] = packed[:, _num_pose_landmarks:-_num_hand_landmarks]
+    frames[2, :, :_num_hand_landmarks] = packed[:, -_num_hand_landmarks:]
+
+    return frames
+
+
+class Clip:
+    """
+    A clip read from a file or a bundle, its landmarks still in their stored dtype and memory
+    mapped when possible.
+    """
+
+    def __init__(self, fps: int, data: np.ndarray, scale: Vec3, left_range: tuple[int, int], right_range: tuple[int, int]):
+        self.fps = fps
+        self.data = data
+        self.scale = scale
+        self.left_range = left_range
+        self.right_range = right_range
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def quantized(self) -> bool:
+        return self.data.dtype != np.float32
+
+    def landmarks(self) -> VecNxNx3:
+        """
+        The (T, 75, 3) float32 landmarks, without a copy unless they are quantized.
+        """
+
+        if not self.quantized:
+            return self.data
+
+        return self.data * self.scale
+
+    @property
+    def pose(self) -> VecNxNx3:
+        return self.landmarks()[:, :_num_pose_landmarks]
+
+    @property
+    def left_hand(self) -> VecNxNx3:
+        return self.landmarks()[:, _num_pose_landmarks:-_num_hand_landmarks]
+
+    @property
+    def right_hand(self) -> VecNxNx3:
+        return self.landmarks()[:, -_num_hand_landmarks:]
+
+    def to_legacy(self) -> VecNxNxNx3:
+        return unpack(self.landmarks())
+
+
+def encode(frames: VecNxNxNx3, quantize: bool = False) -> tuple[np.ndarray, Vec3, tuple[int, int], tuple[int, int]]:
+    """
+    Packs legacy (3, T, 33, 3) landmarks, quantized to int16 when quantize is set, and returns
+    them along with their scale per axis and the presence ranges of the hands.
+    """
+
+    packed = pack(frames)
+
+    if quantize:
+        # Symmetric, so that the zeros of the missing hands stay exactly zero
+        scale = np.abs(packed).max(axis=(0, 1)) / np.iinfo(np.int16).max
+        scale[scale == 0] = 1
+        scale = scale.astype(np.float32)
+
+        data = np.round(packed / scale).astype(dtypes[1])
+    else:
+        scale = np.ones(3, dtype=np.float32)
+        data = packed.astype(dtypes[0])
+
+    return data, scale, _presence_range(frames[1]), _presence_range(frames[2])
+
+
+def write_clip(path: str, frames: VecNxNxNx3, fps: int, quantize: bool = False) -> None:
+    """
+    Writes legacy (3, T, 33, 3) landmarks as a clip, quantized to int16 when quantize is set.
+    """
+
+    data, scale, left_range, right_range = encode(frames, quantize)
+
+    header = _header.pack(
+        _magic,
+        _version,
+        dtypes.index(data.dtype),
+        fps,
+        len(data),
+        *left_range,
+        *right_range,
+        *scale
+    )
+
+    with open(path, 'wb') as f:
+        f.write(header.ljust(_header_size, b'\0'))
+        f.write(data.tobytes())
+
+
+def read_clip(path: str, mmap: bool = True) -> Clip:
+    with open(path, 'rb') as f:
+        header = f.read(_header_size)
+
+    if len(header) != _header_size:
+        raise ValueError(f'{path} is not a clip')
+
+    magic, version, dtype, fps, num_frames, *ranges_and_scale = _header.unpack(header[:_header.size])
+
+    if magic != _magic:
+        raise ValueError(f'{path} is not a clip')
+
+    if version != _version:
+        raise ValueError(f'{path} is a version {version} clip, only version {_version} is supported')
+
+    left_start, left_stop, right_start, right_stop, *scale = ranges_and_scale
+    dtype = dtypes[dtype]
+    shape = (num_frames, num_landmarks, 3)
+
+    if mmap and num_frames > 0:
+        data = np.memmap(path, dtype=dtype, mode='r', offset=_header_size, shape=shape)
+    else:
+        data = np.fromfile(path, dtype=dtype, offset=_header_size).reshape(shape)
+
+    return Clip(fps, data, np.array(scale, dtype=np.float32), (left_start, left_stop), (right_start, right_stop))
+
+
+def convert_legacy(path: str, out_dir: str | None = None, quantize: bool = False) -> str:
+    """
+    Converts a legacy <word>__fps<fps>.npy file to <word>.clip, in out_dir if given, else next
+    to it, and returns the path of the clip.
+    """
+
+    directory, file_name = os.path.split(path)
+    match = re.fullmatch(r'(.*)__fps(\d+)\.npy', file_name)
+
+    if match is None:
+        raise ValueError(f'{path} is not a legacy landmarks file')
+
+    word, fps = match.group(1), int(match.group(2))
+    clip_path = os.path.join(out_dir if out_dir is not None else directory, word + clip_extension)
+
+    write_clip(clip_path, np.load(path), fps, quantize)
+
+    return clip_path
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    rng = np.random.default_rng(0)
+
+    frames = np.zeros((3, 40, 33, 3), dtype=np.float32)
+    frames[0] = rng.random((40, 33, 3))
+    frames[1, 3:30, :21] = rng.random((27, 21, 3))
+    frames[2, :38, :21] = rng.random((38, 21, 3)) - 0.5
+    frames[2, 10] = 0
+
+    assert np.array_equal(unpack(pack(frames)), frames)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'casă__fps30.npy')
+        np.save(path, frames)
+
+        clip = read_clip(convert_legacy(path))
+
+        assert clip.fps == 30 and len(clip) == 40 and not clip.quantized
+        assert clip.left_range == (3, 30) and clip.right_range == (0, 38)
+        assert isinstance(clip.data, np.memmap)
+        assert np.array_equal(clip.to_legacy(), frames)
+        assert np.array_equal(clip.right_hand, frames[2, :, :21])
+
+        clip_path = convert_legacy(path, quantize=True)
+        clip = read_clip(clip_path, mmap=False)
+
+        assert clip.quantized and clip.fps == 30
+        assert os.path.getsize(clip_path) == _header_size + 40 * 75 * 3 * 2
+        # The missing hands stay exactly zero
+        assert np.array_equal(clip.to_legacy() == 0, frames == 0)
+        assert np.allclose(clip.to_legacy(), frames, atol=np.abs(frames).max() / 32767)
+
+        empty = os.path.join(directory, 'empty.clip')
+        write_clip(empty, np.zeros((3, 0, 33, 3), dtype=np.float32), 25)
+        assert len(read_clip(empty)) == 0
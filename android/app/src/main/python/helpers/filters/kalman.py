@@ -1,6 +1,7 @@
 import numpy as np
+from functools import lru_cache
 
-from ..math_types import Vec3
+from ..math_types import Vec3, VecNx3
 
 _dim_state = 6  # 3 For position (x, y, z) and 3 for velocity (vx, vy, vz)
 _dim_measurement = 3  # Only position (x, y, z) is measured
@@ -84,4 +85,105 @@ def kalman_update(H, R, P_pred, x_pred, measurement):
     K = P_pred @ H.T @ np.linalg.inv(S)
     x_updated = x_pred + K @ y
     P_updated = (np.eye(_dim_state) - K @ H) @ P_pred
-    return x_updated, P_updated
\ No newline at end of file
+    return x_updated, P_updated
+
+# Batched variants: the matrices A, H, Q, R are shared, while P (..., 6, 6) and x (..., 6)
+# hold one filter per landmark, so all landmarks are advanced together.
+
+def kalman_init_batch(
+    first_landmarks: VecNx3,
+    second_landmarks: VecNx3,
+    dt: float,
+    process_noise_cov: float = 0.001,
+    measurement_noise_cov: float = 0.0015
+):
+    """Initialize and return Kalman Filter parameters for a stack of 3D landmarks."""
+
+    A, H, Q, R, P, _ = kalman_init(np.zeros(3), np.zeros(3), dt, process_noise_cov, measurement_noise_cov)
+
+    v = (np.array(second_landmarks) - np.array(first_landmarks)) / dt
+    x = np.concatenate((first_landmarks, v), axis=-1)
+
+    P = np.broadcast_to(P, x.shape[:-1] + P.shape).copy()
+
+    return A, H, Q, R, P, x
+
+def kalman_predict_batch(A, Q, P, x):
+    """Predict the next state of every filter."""
+
+    x_pred = x @ A.T
+    P_pred = A @ P @ A.T + Q
+
+    return x_pred, P_pred
+
+def kalman_update_batch(H, R, P_pred, x_pred, measurements):
+    """Update the state of every filter with its new measurement."""
+    # Measurement residual
+    y = measurements - x_pred @ H.T
+    # Residual covariance
+    S = H @ P_pred @ H.T + R
+    # Kalman gain
+    K = P_pred @ H.T @ np.linalg.inv(S)
+    x_updated = x_pred + (K @ y[..., np.newaxis])[..., 0]
+    P_updated = (np.eye(_dim_state) - K @ H) @ P_pred
+    return x_updated, P_updated
+
+
+# Steady state
+#
+# A, H, Q and R only depend on the fps and the noise, so the covariance, and thus the gain,
+# only depends on how many updates happened since P was last set: either by kalman_init or by
+# a missing landmark reset. The gains for each such step are precomputed once, until they
+# converge to the steady state gain, and the update becomes x = x_pred + K (z - H x_pred).
+
+_P_missing_value = 1000000
+
+@lru_cache(maxsize=16)
+def kalman_gain_schedule(
+    dt: float,
+    process_noise_cov: float = 0.001,
+    measurement_noise_cov: float = 0.0015,
+    tol: float = 1e-12,
+    max_steps: int = 10000
+):
+    """
+    Return the Kalman gains (2, M, 6, 3) for the fps and noise.
+
+    gains[0][k] is the gain of the k-th update after kalman_init,
+    gains[1][k] the gain of the k-th update after a missing landmark reset.
+    For k >= M - 1 the gain is the steady state one, gains[:, -1].
+    """
+
+    A, H, Q, R, P_init, _ = kalman_init(np.zeros(3), np.zeros(3), dt, process_noise_cov, measurement_noise_cov)
+    P_reset = np.diag([_P_missing_value] * _dim_state)
+
+    def schedule(P):
+        gains = []
+
+        for _ in range(max_steps):
+            P_pred = A @ P @ A.T + Q
+            S = H @ P_pred @ H.T + R
+            K = P_pred @ H.T @ np.linalg.inv(S)
+            P = (np.eye(_dim_state) - K @ H) @ P_pred
+
+            if gains and np.abs(K - gains[-1]).max() < tol:
+                break
+
+            gains.append(K)
+
+        return gains
+
+    schedules = [schedule(P_init), schedule(P_reset)]
+    steps = max(len(gains) for gains in schedules)
+
+    # Pad the shorter schedule with its converged gain
+    gains = np.array([gains + [gains[-1]] * (steps - len(gains)) for gains in schedules])
+    gains.setflags(write=False)
+
+    return gains
+
+def kalman_update_steady_batch(gains, H, x_pred, measurements):
+    """Update the state of every filter with its new measurement, using precomputed gains (..., 6, 3)."""
+    # Measurement residual
+    y = measurements - x_pred @ H.T
+    return x_pred + (gains @ y[..., np.newaxis])[..., 0]
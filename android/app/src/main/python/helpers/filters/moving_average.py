@@ -3,27 +3,37 @@ import numpy as np
 from ..math_types import *
 
 
-def _moving_average_filter(data: Vec, window_size: int) -> Vec:
-    # Extend the start and end of the data array to handle boundary conditions
-    pad_size = window_size // 2
-    padded_data = np.pad(data, (pad_size, pad_size), 'edge')
-    # Apply the moving average filter
-    smoothed = np.convolve(padded_data, np.ones(window_size) / window_size, mode='same')
-    # Return the section of the smoothed array that corresponds to the original data size
-    return smoothed[pad_size:-pad_size]
-
-def _transform(a: VecNxNx3) -> VecNxNx3:
-    return np.transpose(a, (1, 0, 2))
-
 def moving_average_smooth(
     a: VecNxNx3,
-    window_size: int
+    window_size: int,
+    out: VecNxNx3 | None = None
 ) -> VecNxNx3:
-    a = _transform(a)
+    """
+    Smooths a (..., T, N, 3) block of landmarks along its time axis, -3, with a moving average.
+
+    The data is extended with its first and last frames so every window is full, then all the
+    windows are summed at once from a prefix sum. out may alias a for in-place smoothing.
+    """
+
+    if out is None:
+        out = np.empty_like(a)
+
+    # Window i covers the frames [i - window_size // 2, i + (window_size - 1) // 2]
+    pad_size = window_size // 2
+    pad_width = [(0, 0)] * a.ndim
+    pad_width[-3] = (pad_size, window_size - 1 - pad_size)
+    padded_data = np.pad(a, pad_width, 'edge')
+
+    shape = list(padded_data.shape)
+    shape[-3] += 1
+    prefix_sum = np.zeros(shape)
+    np.cumsum(padded_data, axis=-3, out=prefix_sum[..., 1:, :, :])
 
-    smoothed = np.zeros_like(a)
-    for i in range(a.shape[0]):
-        for j in range(3):
-            smoothed[i, :, j] = _moving_average_filter(a[i, :, j], window_size)
+    np.divide(
+        prefix_sum[..., window_size:, :, :] - prefix_sum[..., :-window_size, :, :],
+        window_size,
+        out=out,
+        casting='unsafe'
+    )
 
-    return _transform(smoothed)
\ No newline at end of file
+    return out
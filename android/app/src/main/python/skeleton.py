@@ -1,12 +1,16 @@
+import hashlib
 import json
 import numpy as np
+import os
+import re
 import struct
+import tempfile
 from io import BufferedReader
 from typing import Dict
 
 from helpers.math_types import *
 from helpers.bones_mapper import build_bone_names_map
-from helpers.three import decompose_mat
+from helpers.three import decompose_mat, make_basis, normalize
 
 
 _bone_indexes_map = {
@@ -150,9 +154,113 @@ class Bone:
         self.scale = scale
         self.name = name
 
+# Bump when the cache layout changes
+_rig_cache_version = 1
+
+_sides = ['Left', 'Right']
+_fingers = ['Thumb', 'Index', 'Middle', 'Ring', 'Pinky']
+
+
+class Rig:
+    """
+    Everything the IK reads from a skeleton, compiled once into index and vector arrays.
+
+    Bones are addressed by their index in the rotations array (_indexes_bone_map)
+    and landmarks by their index in the pose or hand landmarks (_bone_indexes_map).
+    Arrays with a leading axis of 2 are indexed by side: 0 is left, 1 is right.
+    """
+
+    def __init__(self, skeleton: 'Skeleton') -> None:
+        bone_index = _indexes_bone_map.__getitem__
+        landmark_index = _bone_indexes_map.__getitem__
+
+        # Body
+
+        self.hips = bone_index('Hips')
+        self.neck = bone_index('Neck')
+        self.head = bone_index('Head')
+
+        # Pose landmarks: shoulders, up legs, ears
+        self.body_landmarks = np.array([
+            landmark_index(name) for name in [
+                'LeftShoulder', 'RightShoulder', 'LeftUpLeg', 'RightUpLeg', 'LeftEar', 'RightEar'
+            ]
+        ])
+        self.eye_landmarks = np.array([landmark_index('LeftEye'), landmark_index('RightEye')])
+
+        # Rest directions of the hips' children: left up leg, right up leg, spine
+        self.hips_rest = np.array([
+            skeleton.get_translation(name) for name in ['LeftUpLeg', 'RightUpLeg', 'Spine']
+        ])
+        self.neck_rest = np.array(skeleton.get_translation('Head'))
+
+        # The eyes are optional
+        if skeleton.has_bone('LeftEye') and skeleton.has_bone('RightEye'):
+            self.eyes_rest = np.array([skeleton.get_translation('LeftEye'), skeleton.get_translation('RightEye')])
+        else:
+            self.eyes_rest = None
+
+        # Arms: shoulder, up arm, low arm
+
+        self.arm_bones = np.array([
+            [bone_index(f'{side}{name}') for name in ['Shoulder', 'UpArm', 'LowArm']] for side in _sides
+        ])
+        self.arm_landmarks = np.array([
+            [landmark_index(f'{side}{name}') for name in ['Shoulder', 'UpArm', 'LowArm']] for side in _sides
+        ])
+        self.arm_rest = np.array([
+            [skeleton.get_translation(f'{side}{name}') for name in ['UpArm', 'LowArm', 'Hand']] for side in _sides
+        ])
+
+        # Hands
+
+        self.hand_bones = np.array([bone_index(f'{side}Hand') for side in _sides])
+        # Hand landmarks spanning the palm: hand, index, middle, pinky
+        self.palm_landmarks = np.array([
+            landmark_index(f'Left{name}') for name in ['Hand', 'Index1', 'Middle1', 'Pinky1']
+        ])
+        self.hand_bind = np.array([self._hand_bind_basis(skeleton, side) for side in _sides])
+
+        # Fingers: joints 1 to 3 are rotated, joint 4 is the tip
+
+        self.finger_bones = np.array([
+            [[bone_index(f'{side}{finger}{j}') for j in range(1, 4)] for finger in _fingers] for side in _sides
+        ])
+        self.finger_landmarks = np.array([
+            [landmark_index(f'Left{finger}{j}') for j in range(1, 5)] for finger in _fingers
+        ])
+        self.finger_rest = np.array([
+            [[skeleton.get_translation(f'{side}{finger}{j}') for j in range(2, 5)] for finger in _fingers]
+                for side in _sides
+        ])
+
+
+    @staticmethod
+    def _hand_bind_basis(skeleton: 'Skeleton', side: str) -> Mat4:
+        dir_index_to_pinky_bone = normalize(skeleton.get_translation(f'{side}Pinky1') - skeleton.get_translation(f'{side}Index1'))
+
+        hand_bone_v = normalize(skeleton.get_translation(f'{side}Middle1'))
+        hand_bone_w = np.cross(dir_index_to_pinky_bone, hand_bone_v)
+        hand_bone_u = np.cross(hand_bone_v, hand_bone_w)
+
+        return make_basis(hand_bone_u, hand_bone_v, hand_bone_w)
+
+
 class Skeleton:
-    def __init__(self, char_path: str) -> None:
-        self._read_skeleton_from_file(char_path)
+    """
+    A character's skeleton, read from its GLB file.
+
+    If cache_dir is given, the parsed bones are stored there in a small .npy file keyed by
+    the hash of the GLB's JSON chunk, and later loads read that instead of parsing the glTF.
+    A changed GLB hashes differently, so its stale cache is never read.
+    """
+
+    def __init__(self, char_path: str, cache_dir: str | None = None) -> None:
+        self._read_skeleton_from_file(char_path, cache_dir)
+
+
+    def has_bone(self, bone_name: str) -> bool:
+        return bone_name in self._bones
 
 
     def get_translation(self, bone_name: str) -> Vec3:
@@ -188,39 +296,102 @@ class Skeleton:
 
 
     def get_landmark(self, bone_name: str, landmarks: VecNx3) -> Vec3:
-        return landmarks[_bone_indexes_map[bone_name]]
+        return landmarks[..., _bone_indexes_map[bone_name], :]
 
 
-    def _read_skeleton_from_file(self, char_path: str) -> None:
+    def _read_skeleton_from_file(self, char_path: str, cache_dir: str | None) -> None:
         with open(char_path, 'rb') as fin:
-            self._read_skeleton(fin)
-            
-
-    def _read_skeleton(self, char: BufferedReader) -> None:
-        def extract_json_from_glb(glb: BufferedReader) -> dict:
-            # 12 bytes header
-            header = glb.read(12)
-            _, version, length = struct.unpack('<Iii', header)
-            
-            if version != 2:
-                raise ValueError("Must be GLB v2")
-            
-            # Parse chunks
-            while glb.tell() < length:
-                chunk_header = glb.read(8)
-                chunk_length, chunk_type = struct.unpack('<Ii', chunk_header)
-                # JSON chunk
-                if chunk_type == 0x4E4F534A:
-                    json_bytes = glb.read(chunk_length)
-                    json_data = json.loads(json_bytes.decode('utf-8'))
-                    return json_data
-                else:
-                    # Skip chunk
-                    glb.seek(chunk_length, 1)
-
-            raise ValueError('JSON chunk not found')
-
-        json_data = extract_json_from_glb(char)
+            json_bytes = _extract_json_chunk(fin)
+
+        # Identifies the rig, for the rig cache and for the rotations baked for it
+        self.rig_digest = hashlib.md5(json_bytes).digest()
+
+        if cache_dir is None:
+            self._read_skeleton(json_bytes)
+        else:
+            self._read_skeleton_cached(json_bytes, char_path, cache_dir)
+
+        self.rig = Rig(self)
+
+
+    def _read_skeleton_cached(self, json_bytes: bytes, char_path: str, cache_dir: str) -> None:
+        # The skeleton only depends on the glTF JSON chunk, so that is what the cache is keyed by
+        char_name = os.path.splitext(os.path.basename(char_path))[0]
+        cache_path = os.path.join(cache_dir, f'{char_name}.{self.rig_digest.hex()}.v{_rig_cache_version}.npy')
+
+        try:
+            self._read_rig_cache(cache_path)
+            return
+        except (OSError, ValueError, KeyError):
+            pass
+
+        self._read_skeleton(json_bytes)
+
+        try:
+            self._write_rig_cache(cache_path, char_name)
+        except OSError:
+            # Caching is best effort
+            pass
+
+
+    def _read_rig_cache(self, cache_path: str) -> None:
+        records = np.load(cache_path, mmap_mode='r')
+
+        keys = records['key'].tolist()
+        names = records['name'].tolist()
+        translations = np.array(records['translation'])
+        rotations = np.array(records['rotation'])
+        scales = np.array(records['scale'])
+
+        self._bone_names_map = dict(zip(keys, names))
+
+        self._bones = dict()
+        for i, (key, value) in enumerate(self._bone_names_map.items()):
+            self._bones[key] = Bone(translations[i], rotations[i], scales[i], value)
+
+
+    def _write_rig_cache(self, cache_path: str, char_name: str) -> None:
+        bones = list(self._bones.items())
+
+        dtype = np.dtype([
+            ('key', f'U{max(len(key) for key, _ in bones)}'),
+            ('name', f'U{max(len(bone.name) for _, bone in bones)}'),
+            ('translation', np.float64, 3),
+            ('rotation', np.float64, 4),
+            ('scale', np.float64, 3)
+        ])
+
+        records = np.array([
+            (key, bone.name, bone.translation, bone.rotation, bone.scale) for key, bone in bones
+        ], dtype)
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+        # Write next to the target and rename, so a concurrent reader never sees a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                np.save(fout, records)
+            os.replace(tmp_path, cache_path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+        # Drop the caches of previous versions of this character, and only of this one: a character
+        # named a must leave those of a.v2 alone
+        own_cache = re.compile(re.escape(char_name) + r'\.[0-9a-f]{32}\.v\d+\.npy')
+
+        for file_name in os.listdir(os.path.dirname(cache_path)):
+            path = os.path.join(os.path.dirname(cache_path), file_name)
+            if own_cache.fullmatch(file_name) and path != cache_path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+    def _read_skeleton(self, json_bytes: bytes) -> None:
+        json_data = json.loads(json_bytes.decode('utf-8'))
 
         nodes = json_data['nodes']
         
@@ -258,3 +429,25 @@ class Skeleton:
         self._bones = dict()
         for key, value in self._bone_names_map.items():
             self._bones[key] = Bone(translation[value], rotation[value], scale[value], value)
+
+
+def _extract_json_chunk(glb: BufferedReader) -> bytes:
+    # 12 bytes header
+    header = glb.read(12)
+    _, version, length = struct.unpack('<Iii', header)
+    
+    if version != 2:
+        raise ValueError("Must be GLB v2")
+    
+    # Parse chunks
+    while glb.tell() < length:
+        chunk_header = glb.read(8)
+        chunk_length, chunk_type = struct.unpack('<Ii', chunk_header)
+        # JSON chunk
+        if chunk_type == 0x4E4F534A:
+            return glb.read(chunk_length)
+        else:
+            # Skip chunk
+            glb.seek(chunk_length, 1)
+
+    raise ValueError('JSON chunk not found')
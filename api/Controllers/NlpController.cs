@@ -114,4 +114,8 @@ public class SentencePayload
 
     [JsonProperty("is_end")]
     public bool IsEnd { get; set; }
+
+    // Set by the app for every utterance, so the NLP service only parses its end
+    [JsonProperty("session_id")]
+    public string? SessionId { get; set; }
 }
@@ -0,0 +1,77 @@
+import threading
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Bounded, thread safe, least recently used cache, counting its hits and misses.
+    """
+
+    missing = object()
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the value cached for key, or LRUCache.missing, since None is a valid value.
+        """
+
+        with self._lock:
+            value = self._entries.get(key, LRUCache.missing)
+
+            if value is LRUCache.missing:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        # The counters are kept, they describe the whole lifetime of the cache
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+if __name__ == '__main__':
+    cache = LRUCache(2)
+
+    assert cache.get('a') is LRUCache.missing
+    cache.put('a', None)
+    cache.put('b', ['b'])
+    assert cache.get('a') is None
+
+    # 'b' is now the least recently used
+    cache.put('c', ['c'])
+    assert cache.get('b') is LRUCache.missing
+    assert cache.get('c') == ['c']
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'size': 2, 'maxsize': 2}
+
+    cache.clear()
+    assert len(cache) == 0 and cache.hits == 2 and cache.misses == 2
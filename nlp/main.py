@@ -1,318 +1,213 @@
-import Levenshtein as lev
+import asyncio
+import multiprocessing
 import os
-import platform
-import spacy_stanza
-import sys
+import parsing
+import threading
 
-from collections import Counter
-from fastapi import FastAPI
-from nltk.stem.snowball import SnowballStemmer
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
 
-if platform.system() == "Windows":
-    system_drive = os.getenv("SYSTEMDRIVE")
+app = FastAPI()
 
-    if not system_drive.endswith('\\'):
-        system_drive += '\\'
+# The pipeline and the vocabulary are loaded in the background, concurrently, so health checks
+# are answered right away and requests get a 503 until ready is set
+background_startup = os.getenv('NLP_BACKGROUND_STARTUP', '1') == '1'
 
-    directory = system_drive + "srv"
-else:
-    directory = "/srv"
+ready = threading.Event()
+startup_error = None
 
-directory = os.path.join(directory, 'SignLanguageInterpreter.API', 'landmark')
+# Parsing and matching run in a pool, off the event loop.
+#
+# In thread mode, the default, the pipeline is loaded once, but only one thread at a time runs
+# it, see parsing.pipeline_lock, and only the matching to the vocabulary runs concurrently. The
+# pool then keeps the event loop free and queues the requests, with max_pending as backpressure,
+# but parsing does not scale with the workers.
+#
+# In process mode every worker loads its own pipeline (and holds its own caches and sessions),
+# so parsing scales with the cores, at the cost of a pipeline in memory per worker. The app's
+# process loads nothing and only hands the requests over to them.
+executor_kind = os.getenv('NLP_EXECUTOR', 'thread')
+if executor_kind not in ('thread', 'process'):
+    raise ValueError(f'Unknown NLP_EXECUTOR: {executor_kind}')
 
-app = FastAPI()
-nlp = spacy_stanza.load_pipeline("ro")
-stemmer = SnowballStemmer("romanian")
-
-vocabulary = [file_name[:file_name.find('__fps')] for file_name in os.listdir(directory)]
-
-
-def cosine_dist(a, b):
-    a_vals = Counter(a)
-    b_vals = Counter(b)
-
-    chars = list(a_vals.keys() | b_vals.keys())
-    a_vect = [a_vals.get(c, 0) for c in chars]
-    b_vect = [b_vals.get(c, 0) for c in chars]
-
-    len_a = sum(av * av for av in a_vect) ** 0.5
-    len_b = sum(bv * bv for bv in b_vect) ** 0.5
-    dot = sum(av * bv for av, bv in zip(a_vect, b_vect))
-    cosine = dot / (len_a * len_b)
-
-    return 1 - cosine
-
-
-def find_closest_words(doc, is_end):
-    doc_len = len(doc)
-
-    def search_in_vocab(word):
-        distance_map = dict()
-
-        for vocab_word in vocabulary:
-            max_len = max(1, len(word) // 2)
-            start_a = word[:max_len]
-            start_b = vocab_word[:max_len]
-
-            if start_a == start_b:
-                dist = lev.distance(vocab_word, word)
-            else:
-                dist = sys.maxsize
-                
-            distance_map[vocab_word] = dist
-        
-        min_dist = min(distance_map.values())
-        
-        candidates = [key for key, value in distance_map.items() if value == min_dist]
-        candidates = sorted(candidates, key=lambda x: cosine_dist(word, x))
-
-        for candidate in candidates:
-            if min_dist < int(len(candidate) / 2):
-                return candidate
-        
-        return None
-    
-
-    def process_token(token, idx):
-        token_text = token.text.lower()
-        token_lemma = token.lemma_.lower()
-        token_stem = stemmer.stem(token.text).lower()
-
-        # weirdness
-        if token_text == 'm':
-            if idx < doc_len - 1 and doc[idx + 1].pos_ == 'AUX':
-                return ['eu']
-            else:
-                return ['m']
-
-        elif token_text == 'mânc' or token_text == 'mănânc':
-            return ['mânca']
-            
-        elif token_text == 'n':
-            if idx < doc_len - 1 and (doc[idx + 1].pos_ == 'ADV' or doc[idx + 1].pos_ == 'NOUN'):
-                return ['în']
-            elif idx >= 1 and (doc[idx - 1].pos_ == 'PRON' or doc[idx - 1].pos_ == 'VERB'):
-                return ['în']
-            else:
-                return ['n']
-            
-        elif token_text == 'ă':
-            return ['ă']
-
-        # connection words
-        elif token_text == 'dar':
-            if 'CONJ' in token.pos_:
-                return ['dar (conjuncție)']
-            else:
-                return ['dar (cadou)']
-            
-        elif token_text == 'ori':
-            if 'CONJ' in token.pos_:
-                return ['sau']
-            else:
-                return ['ori']
-            
-        elif token_text == 'fie':
-            if 'CONJ' in token.pos_:
-                return ['sau']
-            else:
-                return ['fi']
-            
-        elif token_text == 'că':
-            return []
-            
-        elif token_text == 'ci':
-            return []
-            
-        elif token_text == 'de':
-            if idx < doc_len - 1 and doc[idx + 1].text == 'ce':
-                return []
-            else:
-                return ['de']
-            
-        elif token_text == 'ce':
-            if idx >= 1 and doc[idx - 1].text == 'de':
-                return ['de ce']
-            else:
-                return ['ce']
-            
-        elif token_text == 'la':
-            if idx < doc_len - 1 and doc[idx + 1].text == 'revedere':
-                return []
-            else:
-                return ['la']
-            
-        elif token_text == 'revedere':
-            if idx >= 1 and doc[idx - 1].text == 'la':
-                return ['la revedere']
-            else:
-                return ['vedea']
-            
-        elif token_text == 'deși':
-            return ['chiar', 'dacă']
-        
-        elif token_text == 'da':
-            if token.pos_ == 'ADV':
-                return ['da (adverb)']
-            else:
-                return ['da (verb)']
-            
-        elif (token.pos_ == 'AUX' or token.pos_ == 'PART') and idx < doc_len - 1 and (doc[idx + 1].pos_ == 'VERB' or doc[idx + 1].pos_ == 'AUX' or doc[idx + 1].pos_ == 'PART'):
-            return []
-            
-        elif token.pos_ == 'DET' and idx < doc_len - 1 and doc[idx + 1].pos_ == 'NUM':
-            return []
-        
-        elif token_text == 'mai' and idx < doc_len - 1 and (doc[idx + 1].text.lower() == 'un' or doc[idx + 1].text.lower() == 'o'):
-            return ['încă']
-
-        # adjectives, nouns, verbs
-        elif token_lemma == 'da':
-            return ['da (verb)']
-        
-        elif token.pos_ == 'VERB':
-            word = search_in_vocab(token_lemma)
-            if word:
-                return [word]
-            word = search_in_vocab(token_stem)
-            if word:
-                return [word]
-            else:
-                return [x for x in token_lemma]
-        
-        elif token.pos_ == 'ADJ' or token.pos_ == 'NOUN':
-            word = search_in_vocab(token_lemma)
-            if word:
-                return [word]
-            word = search_in_vocab(token_text)
-            if word:
-                return [word]
-            word = search_in_vocab(token_stem)
-            if word:
-                return [word]
-            else:
-                return [x for x in token_lemma]
-            
-        # proper name
-        elif token.pos_ == 'PROPN':
-            return [x for x in token_text]
-            
-        # numeral
-        elif token.pos_ == 'NUM' or (token.pos_ == 'X' and any(char.isdigit() for char in token_text)):
-            # only digits
-            if '.' in token_text:
-                token_text = token_text.replace('.', '')
-                if ',' in token_text:
-                    split = token_text.split(',')
-                    res = []
-                    res.extend([x for x in split[0]])
-                    res.append('virgulă')
-                    res.extend([x for x in split[1]])
-                    return res
-
-            # from 1M up, there are digits and letter
-            # (e.g. un milion, 100 (de) milioane)
-            word = search_in_vocab(token_text)
-            if word:
-                return [word]
-            word = search_in_vocab(token_lemma)
-            if word:
-                return [word]
-            else:
-                return [x for x in token_text]
-            
-        # pronoun:
-        elif token.pos_ == "PRON":
-            if token_text == 'eu' or token_text == 'mine' or token_text == 'mă' or token_text == 'mie' or token_text == 'îmi' or token_text == 'mi':
-                return ['eu']
-            elif token_text == 'tu' or token_text == 'tine' or token_text == 'te' or token_text == 'ție' or token_text == 'îți' or token_text == 'ți':
-                return ['tu']
-            elif token_text == 'el' or token_text == 'îl' or token_text == 'l' or token_text == 'lui' or token_text == 'îi' or token_text == 'i':
-                return ['el']
-            elif token_text == 'ea' or token_text == 'o':
-                return ['ea']
-            elif token_text == 'noi' or token_text == 'ne' or token_text == 'nouă' or token_text == 'ni':
-                return ['noi']
-            elif token_text == 'voi' or token_text == 'vă' or token_text == 'vouă' or token_text == 'vi':
-                return ['voi']
-            elif token_text == 'ei' or token_text == 'îi' or token_text == 'i' or token_text == 'lor' or token_text == 'le' or token_text == 'li':
-                return ['ei']
-            elif token_text == 'ele' or token_text == 'le':
-                return ['ele']
-            elif token_text == 'unul' or token_text == 'una':
-                return ['un']
-            else:
-                word = search_in_vocab(token_lemma)
-                if word:
-                    return [word]
-                else:
-                    return []
-            
-        # determiner:
-        elif token.pos_ == "DET":
-            if token_text == 'un' or token_text == 'o':
-                return ['un']
-            elif token_text == 'meu' or token_text == 'mea' or token_text == 'mei' or token_text == 'mele':
-                return ['meu']
-            elif token_text == 'tău' or token_text == 'ta':
-                return ['tău']
-            elif token_text == 'lui':
-                return ['el']
-            elif token_text == 'ei':
-                return ['ea']
-            elif token_text == 'său' or token_text == 'sa':
-                return ['său']
-            elif token_text == 'nostru':
-                return ['nostru']
-            elif token_text == 'vostru':
-                return ['vostru']
-            elif token_text == 'lor':
-                return ['ei']
-            else:
-                word = search_in_vocab(token_lemma)
-                if word:
-                    return [word]
-                else:
-                    return []
-
-        else:
-            word = search_in_vocab(token_lemma)
-            if word:
-                return [word]
-            else:
-                return []
-
-    if is_end:
-        res_0 = process_token(doc[-3], doc_len - 3)
-        res_1 = process_token(doc[-2], doc_len - 2)
-        res_2 = process_token(doc[-1], doc_len - 1)
-
-        return [res_0, res_1, res_2]
-    else:
-        res_0 = process_token(doc[-3], doc_len - 3)
-        
-        return [res_0]
+num_workers = int(os.getenv('NLP_WORKERS', os.cpu_count() or 1))
+# Requests accepted but not answered yet, past which new ones are turned away
+max_pending = int(os.getenv('NLP_MAX_PENDING', 4 * num_workers))
+# Sentences of a single /sentences/ request, which only takes one pending slot
+max_batch = int(os.getenv('NLP_MAX_BATCH', 64))
+
+# Created by the startup hook, only in the process serving the app
+executor = None
+# Passed to every process worker, see parsing.worker_cache_stats
+worker_barrier = None
+
+# Only ever changed from the event loop, so no lock is needed
+pending = 0
+
+# Seconds /cache/ waits for every process worker to be free to report its caches
+cache_stats_timeout = 5
+# One /cache/ at a time, as each one holds all the process workers at once
+cache_stats_lock = asyncio.Lock()
+
+# Words before and after the new stable ones that are parsed with them, as context for the tagger.
+# The last 2 words of a partial utterance may still change, like in /sentence/.
+stream_context_words = 2
+stream_unstable_words = 2
+
+
+def load():
+    global startup_error
 
+    try:
+        parsing.load()
+    except Exception as e:
+        startup_error = e
+        raise
 
-def sentence_to_lexemes(sentence, is_end):
-    doc = nlp(sentence)
-    doc_len = len(doc)
+    ready.set()
 
-    while doc_len < 3:
-        if is_end:
-            sentence += " ."
-            doc = nlp(sentence)
-            doc_len = len(doc)
-        else:
-            raise ValueError('Send at least 3 tokens')
 
-    return find_closest_words(doc, is_end)
+def start_workers():
+    global startup_error
+
+    # Every worker loads as it starts, so the pool is ready once each of them answered
+    futures = [executor.submit(parsing.vocabulary_size) for _ in range(num_workers)]
+
+    try:
+        for future in futures:
+            future.result()
+    except Exception as e:
+        startup_error = e
+        raise
+
+    ready.set()
 
 
 class SentencePayload(BaseModel):
     sentence: str
     is_end: bool
+    # Set by clients resending an ever growing utterance, to only have its end parsed
+    session_id: str | None = None
+
+
+class StreamPayload(BaseModel):
+    sentence: str
+    is_end: bool = False
+
+
+async def run_in_executor(fn, *args):
+    global pending
+
+    if startup_error is not None:
+        raise HTTPException(status_code=503, detail=f'Startup failed: {startup_error!r}')
+
+    if not ready.is_set():
+        raise HTTPException(status_code=503, detail='Still loading', headers={'Retry-After': '5'})
+
+    if pending >= max_pending:
+        raise HTTPException(status_code=503, detail='Too many pending requests', headers={'Retry-After': '1'})
+
+    pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    except BrokenProcessPool as e:
+        raise HTTPException(status_code=503, detail=f'Workers failed: {e!r}')
+    finally:
+        pending -= 1
+
+
+# Only runs in the process serving the app: process workers load in parsing.init_worker instead,
+# and the parent loads nothing, it just waits for them
+@app.on_event("startup")
+def start():
+    global executor, worker_barrier
+
+    if executor_kind == 'process':
+        # Spawned, not forked, since the event loop's threads are running
+        context = multiprocessing.get_context('spawn')
+        worker_barrier = context.Barrier(num_workers)
+
+        executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=context,
+            initializer=parsing.init_worker,
+            initargs=(worker_barrier,)
+        )
+        startup = start_workers
+    else:
+        executor = ThreadPoolExecutor(max_workers=num_workers)
+        startup = load
+
+    if background_startup:
+        threading.Thread(target=startup, name='startup', daemon=True).start()
+    else:
+        startup()
+
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    if parsing.vocabulary_watcher is not None:
+        parsing.vocabulary_watcher.stop()
+
+    if executor is not None:
+        executor.shutdown(cancel_futures=True)
+
+
+@app.get("/health/live")
+async def liveness():
+    return {'status': 'alive'}
+
+
+@app.get("/health/ready")
+async def readiness():
+    if startup_error is not None:
+        raise HTTPException(status_code=503, detail=f'Startup failed: {startup_error!r}')
+
+    if not ready.is_set():
+        raise HTTPException(status_code=503, detail='Still loading', headers={'Retry-After': '5'})
+
+    if executor_kind != 'process':
+        return {'status': 'ready', 'vocabulary': parsing.vocabulary_size()}
+
+    # Only the workers hold a vocabulary, and they may have died since
+    try:
+        size = await asyncio.get_running_loop().run_in_executor(executor, parsing.vocabulary_size)
+    except BrokenProcessPool as e:
+        raise HTTPException(status_code=503, detail=f'Workers failed: {e!r}')
+
+    return {'status': 'ready', 'vocabulary': size}
+
+
+@app.get("/cache/")
+async def cache_stats():
+    if executor_kind != 'process':
+        return parsing.cache_stats()
+
+    if startup_error is not None:
+        raise HTTPException(status_code=503, detail=f'Startup failed: {startup_error!r}')
+
+    if not ready.is_set():
+        raise HTTPException(status_code=503, detail='Still loading', headers={'Retry-After': '5'})
+
+    # Each worker has caches of its own, so every one of them is asked for its stats
+    async with cache_stats_lock:
+        if worker_barrier.broken:
+            worker_barrier.reset()
+
+        loop = asyncio.get_running_loop()
+        futures = [loop.run_in_executor(executor, parsing.worker_cache_stats, cache_stats_timeout)
+                   for _ in range(num_workers)]
+
+        try:
+            stats = await asyncio.gather(*futures)
+        except threading.BrokenBarrierError:
+            raise HTTPException(status_code=503, detail='Workers busy', headers={'Retry-After': '1'})
+        except BrokenProcessPool as e:
+            raise HTTPException(status_code=503, detail=f'Workers failed: {e!r}')
+
+    return {'workers': dict(stats)}
 
 
 @app.post("/sentence/")
@@ -320,7 +215,83 @@ async def process_text(payload: SentencePayload):
     # return sentence_to_lexemes(payload.sentence, payload.is_end)
 
     print(f'sentence: {payload.sentence}\nis_end: {payload.is_end}\n')
-    lexemes = sentence_to_lexemes(payload.sentence, payload.is_end)
+    lexemes = await run_in_executor(parsing.sentence_to_lexemes, payload.sentence, payload.is_end, payload.session_id)
     print(f'lexemes: {lexemes}')
 
     return lexemes
+
+
+@app.post("/sentences/")
+async def process_texts(payloads: list[SentencePayload]):
+    if len(payloads) > max_batch:
+        raise HTTPException(status_code=413, detail=f'At most {max_batch} sentences per batch')
+
+    items = [(payload.sentence, payload.is_end, payload.session_id) for payload in payloads]
+
+    return await run_in_executor(parsing.sentences_to_lexemes, items)
+
+
+@app.websocket("/sentence/stream/")
+async def stream_text(websocket: WebSocket):
+    """
+    The client sends {"sentence", "is_end"} messages with the utterance recognized so far, and gets
+    {"lexemes", "is_end"} back with the lexemes of every token that became stable since, as soon
+    as there is any. All the words are stable once is_end is set, after which a new utterance starts.
+    A message that is invalid or fails is answered with {"error"} instead, and the connection is kept.
+    """
+
+    await websocket.accept()
+
+    # Words of the current utterance whose lexemes were already sent
+    num_sent = 0
+
+    try:
+        while True:
+            # A bad message is answered with an error, the connection is kept
+            try:
+                message = await websocket.receive_json()
+
+                if not isinstance(message, dict):
+                    raise ValueError('expected a JSON object')
+
+                payload = StreamPayload(**message)
+            except ValueError as e:
+                await websocket.send_json({'error': f'Invalid message: {e}'})
+                continue
+
+            words = payload.sentence.split()
+            is_end = payload.is_end
+
+            # Recognition started over without ending the previous utterance
+            if len(words) < num_sent:
+                num_sent = 0
+
+            num_stable = len(words) if is_end else max(0, len(words) - stream_unstable_words)
+            lexemes = []
+
+            if num_stable > num_sent:
+                start = max(0, num_sent - stream_context_words)
+                stop = min(len(words), num_stable + stream_context_words)
+
+                try:
+                    lexemes = await run_in_executor(
+                        parsing.window_lexemes, words[start:stop], num_sent - start, num_stable - start
+                    )
+                except HTTPException as e:
+                    await websocket.send_json({'error': e.detail})
+                    continue
+                except Exception as e:
+                    # Only this message failed, the next ones may well go through
+                    await websocket.send_json({'error': f'Failed: {e!r}'})
+                    continue
+
+                num_sent = num_stable
+
+            if is_end:
+                num_sent = 0
+
+            if lexemes or is_end:
+                await websocket.send_json({'lexemes': lexemes, 'is_end': is_end})
+    except WebSocketDisconnect:
+        pass
+
@@ -0,0 +1,287 @@
+import bisect
+import itertools
+import os
+import platform
+import rules
+import spacy_stanza
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from lru_cache import LRUCache
+from nltk.stem.snowball import SnowballStemmer
+from vocabulary import VocabularyIndex, VocabularyWatcher
+
+# The state of a process that parses: the app's own process in thread mode, or each worker in
+# process mode. Process workers only ever import this module, not the app.
+
+if platform.system() == "Windows":
+    system_drive = os.getenv("SYSTEMDRIVE")
+
+    if not system_drive.endswith('\\'):
+        system_drive += '\\'
+
+    directory = system_drive + "srv"
+else:
+    directory = "/srv"
+
+directory = os.path.join(directory, 'SignLanguageInterpreter.API', 'landmark')
+
+warmup_sentence = 'Eu mănânc un măr la masă.'
+
+nlp = None
+stemmer = None
+vocabulary = []
+vocabulary_index = VocabularyIndex(vocabulary)
+
+# New and deleted landmark files are picked up every that many seconds, 0 to never look again
+vocabulary_poll_seconds = float(os.getenv('NLP_VOCABULARY_POLL_SECONDS', 5))
+vocabulary_watcher = None
+
+# word -> closest vocabulary word
+search_cache = LRUCache(10000)
+# rules.Token -> lexemes
+lexemes_cache = LRUCache(10000)
+
+# Held to swap the vocabulary and clear the caches, and to cache a result only if it was resolved
+# against the current vocabulary, so a result of the old one is never cached after the clear
+vocabulary_lock = threading.Lock()
+
+# The pipeline is not known to be thread safe, so thread workers take turns running it, and
+# only match the tokens to the vocabulary concurrently
+pipeline_lock = threading.Lock()
+
+# Trailing words parsed on each update of a session, enough context for the tagger
+session_window_num_words = 12
+# session id -> (last parsed window, its doc)
+sessions = LRUCache(1000)
+
+# Set in process workers by init_worker, shared by all of them
+worker_barrier = None
+
+
+def swap_vocabulary_index(index):
+    global vocabulary, vocabulary_index
+
+    with vocabulary_lock:
+        # A single reference swap, lookups in flight keep the index they started with
+        vocabulary_index = index
+        vocabulary = index.words
+
+        # Everything cached was resolved against the old vocabulary
+        search_cache.clear()
+        lexemes_cache.clear()
+
+
+def set_vocabulary(words):
+    swap_vocabulary_index(VocabularyIndex(words))
+
+
+def update_vocabulary(added, removed):
+    print(f'vocabulary: +{added} -{removed}')
+    swap_vocabulary_index(vocabulary_index.updated(added, removed))
+
+
+def load_pipeline():
+    global nlp, stemmer
+
+    stemmer = SnowballStemmer("romanian")
+
+    pipeline = spacy_stanza.load_pipeline("ro")
+    # The first call is much slower than the next ones
+    pipeline(warmup_sentence)
+
+    nlp = pipeline
+
+
+def load_vocabulary():
+    global vocabulary_watcher
+
+    vocabulary_watcher = VocabularyWatcher(directory, update_vocabulary, vocabulary_poll_seconds)
+    set_vocabulary(vocabulary_watcher.words)
+
+    if vocabulary_poll_seconds > 0:
+        vocabulary_watcher.start()
+
+
+def load():
+    # The pipeline and the vocabulary are loaded concurrently
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [pool.submit(load_pipeline), pool.submit(load_vocabulary)]
+
+    for future in futures:
+        future.result()
+
+
+def init_worker(barrier):
+    global worker_barrier
+
+    worker_barrier = barrier
+
+    # Raises if loading fails, which breaks the pool instead of leaving the worker hanging
+    load()
+
+
+def vocabulary_size():
+    return len(vocabulary_index)
+
+
+def cache_stats():
+    return {'search': search_cache.stats(), 'lexemes': lexemes_cache.stats(), 'sessions': sessions.stats()}
+
+
+def worker_cache_stats(timeout):
+    """
+    Returns the pid and the cache_stats of the process worker running it. Every worker waits for
+    all the others to take one such task too, so that one task per worker reaches each of them.
+    """
+
+    worker_barrier.wait(timeout)
+
+    return os.getpid(), cache_stats()
+
+
+def run_pipeline(sentence):
+    with pipeline_lock:
+        return nlp(sentence)
+
+
+def run_pipeline_batch(sentences):
+    with pipeline_lock:
+        return list(nlp.pipe(sentences))
+
+
+def search_in_vocab(word):
+    closest = search_cache.get(word)
+    if closest is not LRUCache.missing:
+        return closest
+
+    index = vocabulary_index
+    closest = None
+    min_dist, candidates = index.closest(word)
+
+    candidates = index.rank(word, candidates)
+
+    for candidate in candidates:
+        if min_dist < int(len(candidate) / 2):
+            closest = candidate
+            break
+
+    # Not cached when resolved against an index that was swapped out meanwhile
+    with vocabulary_lock:
+        if index is vocabulary_index:
+            search_cache.put(word, closest)
+
+    return closest
+
+
+def token_lexemes(doc, idx):
+    token = doc[idx]
+    token = rules.Token(
+        token.text.lower(),
+        token.lemma_.lower(),
+        stemmer.stem(token.text).lower(),
+        token.pos_,
+        # The rules only ever look at the token and at its direct neighbours
+        (doc[idx - 1].text, doc[idx - 1].pos_) if idx >= 1 else None,
+        (doc[idx + 1].text, doc[idx + 1].pos_) if idx < len(doc) - 1 else None
+    )
+
+    lexemes = lexemes_cache.get(token)
+    if lexemes is LRUCache.missing:
+        index = vocabulary_index
+        lexemes = tuple(rules.resolve(token, search_in_vocab))
+
+        with vocabulary_lock:
+            if index is vocabulary_index:
+                lexemes_cache.put(token, lexemes)
+
+    return list(lexemes)
+
+
+def find_closest_words(doc, is_end):
+    doc_len = len(doc)
+
+    if is_end:
+        res_0 = token_lexemes(doc, doc_len - 3)
+        res_1 = token_lexemes(doc, doc_len - 2)
+        res_2 = token_lexemes(doc, doc_len - 1)
+
+        return [res_0, res_1, res_2]
+    else:
+        res_0 = token_lexemes(doc, doc_len - 3)
+
+        return [res_0]
+
+
+def trailing_window(sentence, num_words):
+    return ' '.join(sentence.split()[-num_words:])
+
+
+def parse(sentence, session_id=None):
+    if session_id is None:
+        return run_pipeline(sentence)
+
+    # Only the last tokens are ever resolved, so a session only pays for the end of its utterance
+    sentence = trailing_window(sentence, session_window_num_words)
+
+    parsed = sessions.get(session_id)
+    if parsed is not LRUCache.missing and parsed[0] == sentence:
+        return parsed[1]
+
+    doc = run_pipeline(sentence)
+    sessions.put(session_id, (sentence, doc))
+
+    return doc
+
+
+def sentence_to_lexemes(sentence, is_end, session_id=None):
+    doc = parse(sentence, session_id)
+    doc_len = len(doc)
+
+    while doc_len < 3:
+        if is_end:
+            sentence += " ."
+            doc = parse(sentence, session_id)
+            doc_len = len(doc)
+        else:
+            raise ValueError('Send at least 3 tokens')
+
+    return find_closest_words(doc, is_end)
+
+
+def sentences_to_lexemes(items):
+    """
+    sentence_to_lexemes over many (sentence, is_end, session_id) items at once, with all the
+    sentences going through the pipeline together. Items with too few tokens give None
+    instead of failing the whole batch. Sessions only bound the parsed window here.
+    """
+
+    sentences = [sentence if session_id is None else trailing_window(sentence, session_window_num_words)
+                 for sentence, _, session_id in items]
+    docs = run_pipeline_batch(sentences)
+
+    short = [i for i, doc in enumerate(docs) if len(doc) < 3 and items[i][1]]
+
+    while short:
+        for i in short:
+            sentences[i] += " ."
+
+        for i, doc in zip(short, run_pipeline_batch([sentences[i] for i in short])):
+            docs[i] = doc
+
+        short = [i for i in short if len(docs[i]) < 3]
+
+    return [find_closest_words(doc, is_end) if len(doc) >= 3 else None
+            for doc, (_, is_end, _) in zip(docs, items)]
+
+
+def window_lexemes(words, first, last):
+    """
+    Parses the words and returns the lexemes of the tokens of the words in [first, last).
+    """
+
+    word_starts = list(itertools.accumulate((len(word) + 1 for word in words[:-1]), initial=0))
+    doc = run_pipeline(' '.join(words))
+
+    return [token_lexemes(doc, i) for i, token in enumerate(doc)
+            if first <= bisect.bisect_right(word_starts, token.idx) - 1 < last]
@@ -0,0 +1,305 @@
+from collections import namedtuple
+
+# Everything the rules may look at: the lower cased text, lemma and stem of the token, its POS,
+# and the (text, POS) of its neighbours, None at the ends of the sentence
+Token = namedtuple('Token', ['text', 'lemma', 'stem', 'pos', 'prev', 'next'])
+
+
+# Conditions.
+
+def next_pos(*pos):
+    return lambda token: token.next is not None and token.next[1] in pos
+
+
+def prev_pos(*pos):
+    return lambda token: token.prev is not None and token.prev[1] in pos
+
+
+def next_text(*texts):
+    return lambda token: token.next is not None and token.next[0] in texts
+
+
+def next_text_lower(*texts):
+    return lambda token: token.next is not None and token.next[0].lower() in texts
+
+
+def prev_text(*texts):
+    return lambda token: token.prev is not None and token.prev[0] in texts
+
+
+def pos_is(*pos):
+    return lambda token: token.pos in pos
+
+
+def pos_contains(part):
+    return lambda token: part in token.pos
+
+
+def has_digit(token):
+    return any(char.isdigit() for char in token.text)
+
+
+# Actions, for the lexemes that are not fixed.
+
+def letters(field):
+    return lambda token, search_in_vocab: [x for x in getattr(token, field)]
+
+
+def search(*fields, otherwise=()):
+    """
+    The closest vocabulary word to the first of the fields having one, else otherwise.
+    """
+
+    def action(token, search_in_vocab):
+        for field in fields:
+            word = search_in_vocab(getattr(token, field))
+            if word:
+                return [word]
+
+        return otherwise(token, search_in_vocab) if callable(otherwise) else list(otherwise)
+
+    return action
+
+
+def lookup(table, otherwise):
+    def action(token, search_in_vocab):
+        word = table.get(token.text)
+        if word is not None:
+            return [word]
+
+        return otherwise(token, search_in_vocab)
+
+    return action
+
+
+def numeral(token, search_in_vocab):
+    text = token.text
+
+    # only digits
+    if '.' in text:
+        text = text.replace('.', '')
+        if ',' in text:
+            split = text.split(',')
+            res = []
+            res.extend([x for x in split[0]])
+            res.append('virgulă')
+            res.extend([x for x in split[1]])
+            return res
+
+    # from 1M up, there are digits and letter
+    # (e.g. un milion, 100 (de) milioane)
+    word = search_in_vocab(text)
+    if word:
+        return [word]
+    word = search_in_vocab(token.lemma)
+    if word:
+        return [word]
+    else:
+        return [x for x in text]
+
+
+def first_wins(groups):
+    """
+    Maps every text of the (texts, word) groups to its word, the earlier groups taking precedence.
+    """
+
+    table = {}
+    for texts, word in groups:
+        for text in texts:
+            table.setdefault(text, word)
+
+    return table
+
+
+pronouns = first_wins([
+    (['eu', 'mine', 'mă', 'mie', 'îmi', 'mi'], 'eu'),
+    (['tu', 'tine', 'te', 'ție', 'îți', 'ți'], 'tu'),
+    (['el', 'îl', 'l', 'lui', 'îi', 'i'], 'el'),
+    (['ea', 'o'], 'ea'),
+    (['noi', 'ne', 'nouă', 'ni'], 'noi'),
+    (['voi', 'vă', 'vouă', 'vi'], 'voi'),
+    (['ei', 'îi', 'i', 'lor', 'le', 'li'], 'ei'),
+    (['ele', 'le'], 'ele'),
+    (['unul', 'una'], 'un')
+])
+
+determiners = first_wins([
+    (['un', 'o'], 'un'),
+    (['meu', 'mea', 'mei', 'mele'], 'meu'),
+    (['tău', 'ta'], 'tău'),
+    (['lui'], 'el'),
+    (['ei'], 'ea'),
+    (['său', 'sa'], 'său'),
+    (['nostru'], 'nostru'),
+    (['vostru'], 'vostru'),
+    (['lor'], 'ei')
+])
+
+
+# Each table maps a field of the token to its rules, (condition, lexemes or action) pairs tried
+# in order, None always holding. The tables are tried in order too, the first rule that holds
+# gives the lexemes, and a token no rule holds for is looked up by lemma.
+
+# Words with their own meaning in sign language, always resolved here
+text_rules = {
+    # weirdness
+    'm': [(next_pos('AUX'), ['eu']), (None, ['m'])],
+    'mânc': [(None, ['mânca'])],
+    'mănânc': [(None, ['mânca'])],
+    'n': [(next_pos('ADV', 'NOUN'), ['în']), (prev_pos('PRON', 'VERB'), ['în']), (None, ['n'])],
+    'ă': [(None, ['ă'])],
+
+    # connection words
+    'dar': [(pos_contains('CONJ'), ['dar (conjuncție)']), (None, ['dar (cadou)'])],
+    'ori': [(pos_contains('CONJ'), ['sau']), (None, ['ori'])],
+    'fie': [(pos_contains('CONJ'), ['sau']), (None, ['fi'])],
+    'că': [(None, [])],
+    'ci': [(None, [])],
+    'de': [(next_text('ce'), []), (None, ['de'])],
+    'ce': [(prev_text('de'), ['de ce']), (None, ['ce'])],
+    'la': [(next_text('revedere'), []), (None, ['la'])],
+    'revedere': [(prev_text('la'), ['la revedere']), (None, ['vedea'])],
+    'deși': [(None, ['chiar', 'dacă'])],
+    'da': [(pos_is('ADV'), ['da (adverb)']), (None, ['da (verb)'])]
+}
+
+# Words with no sign of their own
+pos_context_rules = {
+    'AUX': [(next_pos('VERB', 'AUX', 'PART'), [])],
+    'PART': [(next_pos('VERB', 'AUX', 'PART'), [])],
+    'DET': [(next_pos('NUM'), [])]
+}
+
+text_context_rules = {
+    'mai': [(next_text_lower('un', 'o'), ['încă'])]
+}
+
+lemma_rules = {
+    'da': [(None, ['da (verb)'])]
+}
+
+pos_rules = {
+    # adjectives, nouns, verbs
+    'VERB': [(None, search('lemma', 'stem', otherwise=letters('lemma')))],
+    'ADJ': [(None, search('lemma', 'text', 'stem', otherwise=letters('lemma')))],
+    'NOUN': [(None, search('lemma', 'text', 'stem', otherwise=letters('lemma')))],
+
+    # proper name
+    'PROPN': [(None, letters('text'))],
+
+    # numeral
+    'NUM': [(None, numeral)],
+    'X': [(has_digit, numeral)],
+
+    'PRON': [(None, lookup(pronouns, otherwise=search('lemma')))],
+    'DET': [(None, lookup(determiners, otherwise=search('lemma')))]
+}
+
+stages = [
+    ('text', text_rules),
+    ('pos', pos_context_rules),
+    ('text', text_context_rules),
+    ('lemma', lemma_rules),
+    ('pos', pos_rules)
+]
+
+default = search('lemma')
+
+
+def resolve(token, search_in_vocab):
+    """
+    Returns the lexemes of the token, search_in_vocab giving the closest vocabulary word, if any.
+    """
+
+    for field, table in stages:
+        for condition, lexemes in table.get(getattr(token, field), ()):
+            if condition is None or condition(token):
+                return lexemes(token, search_in_vocab) if callable(lexemes) else list(lexemes)
+
+    return default(token, search_in_vocab)
+
+
+if __name__ == '__main__':
+    # Stand-in for the vocabulary search: an exact match, else the first word sharing the first
+    # 3 characters. The stems below are made up too, by dropping the last character of the
+    # words longer than 3.
+    vocabulary = ['mânca', 'fi', 'avea', 'casă', 'mare', 'frumos', 'un milion', '1', '10', 'sine']
+
+    def search_in_vocab(word):
+        if word in vocabulary:
+            return word
+
+        for vocab_word in vocabulary:
+            if len(word) > 2 and vocab_word.startswith(word[:3]):
+                return vocab_word
+
+        return None
+
+    # Outputs of the if/elif chain these tables replaced
+    golden = [
+        (('m', 'm', 'm', 'PRON', None, ('am', 'AUX')), ['eu']),
+        (('m', 'm', 'm', 'PRON', ('eu', 'PRON'), ('e', 'NOUN')), ['m']),
+        (('mănânc', 'mânca', 'mănân', 'VERB', ('eu', 'PRON'), None), ['mânca']),
+        (('n', 'n', 'n', 'ADP', None, ('casă', 'NOUN')), ['în']),
+        (('n', 'n', 'n', 'ADP', ('eu', 'PRON'), ('a', 'DET')), ['în']),
+        (('n', 'n', 'n', 'ADP', ('a', 'DET'), None), ['n']),
+        (('ă', 'ă', 'ă', 'INTJ', None, ('.', 'PUNCT')), ['ă']),
+        (('dar', 'dar', 'dar', 'CCONJ', None, ('.', 'PUNCT')), ['dar (conjuncție)']),
+        (('dar', 'dar', 'dar', 'NOUN', None, ('.', 'PUNCT')), ['dar (cadou)']),
+        (('ori', 'ori', 'ori', 'CCONJ', None, ('.', 'PUNCT')), ['sau']),
+        (('ori', 'ori', 'ori', 'ADV', None, ('.', 'PUNCT')), ['ori']),
+        (('fie', 'fi', 'fie', 'CCONJ', None, ('.', 'PUNCT')), ['sau']),
+        (('fie', 'fi', 'fie', 'AUX', None, ('.', 'PUNCT')), ['fi']),
+        (('că', 'că', 'că', 'SCONJ', None, ('.', 'PUNCT')), []),
+        (('ci', 'ci', 'ci', 'CCONJ', None, ('.', 'PUNCT')), []),
+        (('de', 'de', 'de', 'ADP', None, ('ce', 'PRON')), []),
+        (('de', 'de', 'de', 'ADP', None, ('Ce', 'PRON')), ['de']),
+        (('ce', 'ce', 'ce', 'PRON', ('de', 'ADP'), None), ['de ce']),
+        (('ce', 'ce', 'ce', 'PRON', None, ('.', 'PUNCT')), ['ce']),
+        (('la', 'la', 'la', 'ADP', None, ('revedere', 'NOUN')), []),
+        (('la', 'la', 'la', 'ADP', None, ('mare', 'NOUN')), ['la']),
+        (('revedere', 'revedere', 'reveder', 'NOUN', ('la', 'ADP'), None), ['la revedere']),
+        (('revedere', 'revedere', 'reveder', 'NOUN', None, ('.', 'PUNCT')), ['vedea']),
+        (('deși', 'deși', 'deș', 'SCONJ', None, ('.', 'PUNCT')), ['chiar', 'dacă']),
+        (('da', 'da', 'da', 'ADV', None, ('.', 'PUNCT')), ['da (adverb)']),
+        (('da', 'da', 'da', 'VERB', None, ('.', 'PUNCT')), ['da (verb)']),
+        (('am', 'avea', 'am', 'AUX', None, ('mâncat', 'VERB')), []),
+        (('să', 'să', 'să', 'PART', None, ('fie', 'AUX')), []),
+        (('un', 'un', 'un', 'DET', None, ('1', 'NUM')), []),
+        (('mai', 'mai', 'mai', 'ADV', None, ('un', 'DET')), ['încă']),
+        (('mai', 'mai', 'mai', 'ADV', None, ('O', 'DET')), ['încă']),
+        (('mai', 'mai', 'mai', 'ADV', None, ('mare', 'ADJ')), []),
+        (('dă', 'da', 'dă', 'VERB', None, ('.', 'PUNCT')), ['da (verb)']),
+        (('mănâncă', 'mânca', 'mănânc', 'VERB', None, ('.', 'PUNCT')), ['mânca']),
+        (('zbor', 'zbura', 'zbo', 'VERB', None, ('.', 'PUNCT')), ['z', 'b', 'u', 'r', 'a']),
+        (('casele', 'casă', 'casel', 'NOUN', None, ('.', 'PUNCT')), ['casă']),
+        (('frumoasă', 'frumos', 'frumoas', 'ADJ', None, ('.', 'PUNCT')), ['frumos']),
+        (('xyzw', 'xyzw', 'xyz', 'NOUN', None, ('.', 'PUNCT')), ['x', 'y', 'z', 'w']),
+        (('ion', 'ion', 'ion', 'PROPN', None, ('.', 'PUNCT')), ['i', 'o', 'n']),
+        (('1.000,5', '1.000,5', '1.000,', 'NUM', None, ('.', 'PUNCT')), ['1', '0', '0', '0', 'virgulă', '5']),
+        (('1.000', '1.000', '1.00', 'NUM', None, ('.', 'PUNCT')), ['1', '0', '0', '0']),
+        (('10', '10', '10', 'NUM', None, ('.', 'PUNCT')), ['10']),
+        (('3a', '3a', '3a', 'X', None, ('.', 'PUNCT')), ['3', 'a']),
+        (('xa', 'xa', 'xa', 'X', None, ('.', 'PUNCT')), []),
+        (('mine', 'eu', 'min', 'PRON', None, ('.', 'PUNCT')), ['eu']),
+        (('îi', 'el', 'îi', 'PRON', None, ('.', 'PUNCT')), ['el']),
+        (('le', 'ei', 'le', 'PRON', None, ('.', 'PUNCT')), ['ei']),
+        (('ele', 'ele', 'ele', 'PRON', None, ('.', 'PUNCT')), ['ele']),
+        (('unul', 'unul', 'unu', 'PRON', None, ('.', 'PUNCT')), ['un']),
+        (('sine', 'sine', 'sin', 'PRON', None, ('.', 'PUNCT')), ['sine']),
+        (('cine', 'cine', 'cin', 'PRON', None, ('.', 'PUNCT')), []),
+        (('o', 'un', 'o', 'DET', None, ('.', 'PUNCT')), ['un']),
+        (('mele', 'meu', 'mel', 'DET', None, ('.', 'PUNCT')), ['meu']),
+        (('ta', 'tău', 'ta', 'DET', None, ('.', 'PUNCT')), ['tău']),
+        (('lui', 'lui', 'lui', 'DET', None, ('.', 'PUNCT')), ['el']),
+        (('ei', 'ei', 'ei', 'DET', None, ('.', 'PUNCT')), ['ea']),
+        (('lor', 'lor', 'lor', 'DET', None, ('.', 'PUNCT')), ['ei']),
+        (('acest', 'acest', 'aces', 'DET', None, ('.', 'PUNCT')), []),
+        (('lui', 'lui', 'lui', 'DET', None, ('1', 'NUM')), []),
+        (('repede', 'repede', 'reped', 'ADV', None, ('.', 'PUNCT')), []),
+        (('avea', 'avea', 'ave', 'INTJ', None, ('.', 'PUNCT')), ['avea'])
+    ]
+
+    for fields, lexemes in golden:
+        token = Token(*fields)
+        assert resolve(token, search_in_vocab) == lexemes, token
@@ -0,0 +1,400 @@
+import json
+import Levenshtein as lev
+import numpy as np
+import os
+import struct
+import sys
+import threading
+
+from collections import Counter
+
+# Columns of the character count vectors, any other character found in the vocabulary gets
+# a column of its own after these
+alphabet = 'aăâbcdefghiîjklmnopqrsșştțţuvwxyz0123456789 ()-'
+
+
+# Landmark bundle written by the library's helpers/landmark_bundle.py: a header with the length
+# of the JSON index that follows it, keyed by word
+bundle_name = 'landmarks.bundle'
+_bundle_header = struct.Struct('<4sHxxQ')
+
+
+def _read_bundle_words(path):
+    with open(path, 'rb') as f:
+        header = f.read(_bundle_header.size)
+
+        if len(header) != _bundle_header.size or header[:4] != b'LSBN':
+            raise ValueError(f'{path} is not a bundle')
+
+        _, version, index_length = _bundle_header.unpack(header)
+
+        if version != 1:
+            raise ValueError(f'{path} is a version {version} bundle, only version 1 is supported')
+
+        index = f.read(index_length)
+
+        # e.g. a bundle still being written
+        if len(index) != index_length:
+            raise ValueError(f'{path} is truncated')
+
+        return list(json.loads(index.decode('utf-8'))['entries'])
+
+
+def read_vocabulary(directory):
+    words = []
+
+    for file_name in os.listdir(directory):
+        if file_name == bundle_name:
+            words += _read_bundle_words(os.path.join(directory, file_name))
+        elif '__fps' in file_name:
+            words.append(file_name[:file_name.find('__fps')])
+        elif file_name.endswith('.clip'):
+            words.append(file_name[:-len('.clip')])
+
+    # A word may have both a file and a bundle entry
+    return list(dict.fromkeys(words))
+
+
+def _extend_columns(columns, words):
+    for word in words:
+        for char in word:
+            columns.setdefault(char, len(columns))
+
+
+def _count_chars(words, columns, out):
+    rows = [i for i, word in enumerate(words) for _ in word]
+    cols = [columns[char] for word in words for char in word]
+    np.add.at(out, (rows, cols), 1)
+
+
+class VocabularyIndex:
+    """
+    Index over the sign vocabulary for the fuzzy lookups of find_closest_words.
+
+    A word only matches the entries starting with its first max(1, len(word) // 2) characters,
+    so the entries are bucketed by prefix, for every prefix length, and each bucket is split
+    by entry length. The Levenshtein distance is at least the length difference, so a lookup
+    visits the lengths closest to the word's first and stops once none can reach the best
+    distance found so far.
+
+    The character counts of all the entries are kept in a matrix, with their norms, so the
+    candidates are ranked by cosine distance with a single matrix-vector product.
+    """
+
+    def __init__(self, words):
+        # Ties are broken by the vocabulary order, so it is kept, without the duplicates
+        self.words = list(dict.fromkeys(words))
+        self._positions = {word: i for i, word in enumerate(self.words)}
+        self._buckets = {}
+
+        for word in self.words:
+            for prefix_len in range(1, len(word) + 1):
+                by_prefix = self._buckets.setdefault(prefix_len, {})
+                by_len = by_prefix.setdefault(word[:prefix_len], {})
+                by_len.setdefault(len(word), []).append(word)
+
+        self._columns = {char: i for i, char in enumerate(alphabet)}
+        _extend_columns(self._columns, self.words)
+
+        self._rows = {word: i for i, word in enumerate(self.words)}
+        self._counts = np.zeros((len(self.words), len(self._columns)), dtype=np.int16)
+        _count_chars(self.words, self._columns, self._counts)
+        self._norms = ((self._counts.astype(np.float64) ** 2).sum(axis=1)) ** 0.5
+
+    def updated(self, added=(), removed=()):
+        """
+        Returns a new index with the words added and removed. Only the buckets they touch are
+        copied, the rest is shared, and this index is left as is for the lookups still using it.
+        """
+
+        removed = {word for word in removed if word in self._positions}
+        added = [word for word in dict.fromkeys(added) if word not in self._positions or word in removed]
+
+        index = VocabularyIndex(())
+        index.words = [word for word in self.words if word not in removed] + added
+        index._positions = {word: position for word, position in self._positions.items() if word not in removed}
+        index._buckets = dict(self._buckets)
+
+        # Positions only order the words, so the new ones just go after all the old ones
+        next_position = max(self._positions.values(), default=-1) + 1
+        for i, word in enumerate(added):
+            index._positions[word] = next_position + i
+
+        copied = set()
+
+        def writable(word, prefix_len):
+            prefix = word[:prefix_len]
+
+            if (prefix_len,) not in copied:
+                index._buckets[prefix_len] = dict(index._buckets.get(prefix_len, {}))
+                copied.add((prefix_len,))
+            by_prefix = index._buckets[prefix_len]
+
+            if (prefix_len, prefix) not in copied:
+                by_prefix[prefix] = dict(by_prefix.get(prefix, {}))
+                copied.add((prefix_len, prefix))
+            by_len = by_prefix[prefix]
+
+            if (prefix_len, prefix, len(word)) not in copied:
+                by_len[len(word)] = list(by_len.get(len(word), []))
+                copied.add((prefix_len, prefix, len(word)))
+
+            return by_len
+
+        for word in removed:
+            for prefix_len in range(1, len(word) + 1):
+                writable(word, prefix_len)[len(word)].remove(word)
+
+        for word in added:
+            for prefix_len in range(1, len(word) + 1):
+                writable(word, prefix_len)[len(word)].append(word)
+
+        kept = [word for word in self.words if word not in removed]
+
+        index._columns = dict(self._columns)
+        _extend_columns(index._columns, added)
+
+        index._rows = {word: i for i, word in enumerate(index.words)}
+        index._counts = np.zeros((len(index.words), len(index._columns)), dtype=np.int16)
+        index._counts[:len(kept), :self._counts.shape[1]] = self._counts[[self._rows[word] for word in kept]]
+        _count_chars(added, index._columns, index._counts[len(kept):])
+        index._norms = ((index._counts.astype(np.float64) ** 2).sum(axis=1)) ** 0.5
+
+        # Drop the buckets left empty, the innermost ones first
+        for key in sorted(copied, key=len, reverse=True):
+            *outer, inner = key
+            parent = index._buckets
+            for k in outer:
+                parent = parent[k]
+
+            if not parent[inner]:
+                del parent[inner]
+
+        return index
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return word in self._positions
+
+    def closest(self, word):
+        """
+        Returns the minimum distance from word to the entries sharing its prefix, along with
+        those entries at that distance, in vocabulary order.
+
+        When no entry shares the prefix, returns (sys.maxsize, []).
+        """
+
+        prefix_len = max(1, len(word) // 2)
+        by_len = self._buckets.get(prefix_len, {}).get(word[:prefix_len])
+
+        if not by_len:
+            return sys.maxsize, []
+
+        min_dist = sys.maxsize
+        candidates = []
+
+        for length in sorted(by_len, key=lambda length: abs(length - len(word))):
+            if abs(length - len(word)) > min_dist:
+                break
+
+            for vocab_word in by_len[length]:
+                dist = lev.distance(vocab_word, word)
+
+                if dist < min_dist:
+                    min_dist = dist
+                    candidates = [vocab_word]
+                elif dist == min_dist:
+                    candidates.append(vocab_word)
+
+        candidates.sort(key=self._positions.__getitem__)
+
+        return min_dist, candidates
+
+    def rank(self, word, candidates):
+        """
+        Returns the candidates, entries of the index, sorted by the cosine distance between their
+        character counts and those of word, keeping their order on ties.
+        """
+
+        if len(candidates) < 2:
+            return list(candidates)
+
+        # A character of word that no entry has only counts towards its norm
+        word_counts = Counter(word)
+        word_vector = np.zeros(len(self._columns))
+        for char, count in word_counts.items():
+            col = self._columns.get(char)
+            if col is not None:
+                word_vector[col] = count
+        word_norm = sum(count * count for count in word_counts.values()) ** 0.5
+
+        rows = [self._rows[candidate] for candidate in candidates]
+        cosine = (self._counts[rows] @ word_vector) / (word_norm * self._norms[rows])
+
+        return [candidates[i] for i in np.argsort(1 - cosine, kind='stable')]
+
+
+class VocabularyWatcher:
+    """
+    Polls the mtime of the landmark directory, which changes whenever a file is added to,
+    removed from or renamed in it, along with the mtime and size of the bundle, which may be
+    overwritten in place, and reports the words that appeared and disappeared.
+    """
+
+    def __init__(self, directory, on_change, interval):
+        self.directory = directory
+        self.on_change = on_change
+        self.interval = interval
+
+        # Read before listing, so a change made meanwhile is caught by the next poll
+        self._signature = self._read_signature()
+        self.words = read_vocabulary(directory)
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read_signature(self):
+        try:
+            bundle_stat = os.stat(os.path.join(self.directory, bundle_name))
+            bundle_signature = (bundle_stat.st_mtime_ns, bundle_stat.st_size)
+        except FileNotFoundError:
+            bundle_signature = None
+
+        return os.stat(self.directory).st_mtime_ns, bundle_signature
+
+    def poll(self):
+        signature = self._read_signature()
+        if signature == self._signature:
+            return
+
+        words = read_vocabulary(self.directory)
+        # Only once read, so a failed read is retried by the next poll
+        self._signature = signature
+
+        old_words = set(self.words)
+        new_words = set(words)
+        added = [word for word in words if word not in old_words]
+        removed = [word for word in self.words if word not in new_words]
+
+        self.words = words
+
+        if added or removed:
+            self.on_change(added, removed)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='vocabulary-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                # e.g. the directory being replaced or the bundle being written by an update,
+                # the next poll retries
+                print(f'vocabulary watcher: {e!r}')
+
+
+if __name__ == '__main__':
+    def cosine_dist(a, b):
+        a_vals = Counter(a)
+        b_vals = Counter(b)
+
+        chars = list(a_vals.keys() | b_vals.keys())
+        a_vect = [a_vals.get(c, 0) for c in chars]
+        b_vect = [b_vals.get(c, 0) for c in chars]
+
+        len_a = sum(av * av for av in a_vect) ** 0.5
+        len_b = sum(bv * bv for bv in b_vect) ** 0.5
+        dot = sum(av * bv for av, bv in zip(a_vect, b_vect))
+        cosine = dot / (len_a * len_b)
+
+        return 1 - cosine
+
+    def brute_force_closest(vocabulary, word):
+        distance_map = dict()
+
+        for vocab_word in vocabulary:
+            max_len = max(1, len(word) // 2)
+
+            if word[:max_len] == vocab_word[:max_len]:
+                distance_map[vocab_word] = lev.distance(vocab_word, word)
+            else:
+                distance_map[vocab_word] = sys.maxsize
+
+        min_dist = min(distance_map.values())
+
+        if min_dist == sys.maxsize:
+            return min_dist, []
+
+        return min_dist, [key for key, value in distance_map.items() if value == min_dist]
+
+    vocabulary = ['casă', 'cas', 'castel', 'casa', 'mânca', 'mână', 'mamă', 'a', 'ab', 'abc',
+                  'eu', 'el', 'ea', 'ei', 'ele', 'la revedere', 'la', 'dar (cadou)', 'dar (conjuncție)',
+                  'da (verb)', 'da (adverb)', 'de ce', 'de', 'casă']
+    index = VocabularyIndex(vocabulary)
+
+    assert len(index) == len(vocabulary) - 1
+    assert 'casă' in index and 'case' not in index
+
+    for word in ['casă', 'case', 'casele', 'c', 'ca', 'mânc', 'mănânc', 'manca', 'e', 'eu', 'elev',
+                 'la', 'lar', 'dar', 'darul', 'da', 'de', 'dece', 'xyz', 'a', 'abcd', 'castele']:
+        assert index.closest(word) == brute_force_closest(vocabulary, word), word
+
+    added = ['case', 'elev', 'casă', 'x']
+    removed = ['casa', 'ea', 'la revedere', 'nu']
+    updated = index.updated(added, removed)
+    new_vocabulary = [word for word in vocabulary if word not in removed] + ['case', 'elev', 'x']
+
+    assert updated.words == list(dict.fromkeys(new_vocabulary))
+    assert 'casa' in index and 'casa' not in updated and 'x' in updated
+
+    for word in ['casă', 'case', 'casa', 'casele', 'e', 'ea', 'elev', 'la', 'lar', 'x', 'xyz']:
+        assert index.closest(word) == brute_force_closest(vocabulary, word), word
+        assert updated.closest(word) == brute_force_closest(new_vocabulary, word), word
+        assert updated.closest(word) == VocabularyIndex(new_vocabulary).closest(word), word
+
+    for word in ['casă', 'case', 'saca', 'aaa', 'șarpe', 'la', 'dar', 'cadou', 'x', 'ab']:
+        for idx, words in [(index, index.words), (updated, updated.words)]:
+            assert idx.rank(word, words) == sorted(words, key=lambda x: cosine_dist(word, x)), word
+
+    import tempfile
+
+    def write_bundle(path, words, truncate=False):
+        index = json.dumps({'entries': {word: {} for word in words}, 'removed': []}).encode('utf-8')
+        data = _bundle_header.pack(b'LSBN', 1, len(index)) + index
+
+        # In place, like an upload would
+        with open(path, 'wb') as f:
+            f.write(data[:_bundle_header.size - 4] if truncate else data)
+
+    with tempfile.TemporaryDirectory() as directory:
+        bundle_path = os.path.join(directory, bundle_name)
+        write_bundle(bundle_path, ['eu'])
+        open(os.path.join(directory, 'casă__fps30.npy'), 'wb').close()
+
+        changes = []
+        watcher = VocabularyWatcher(directory, lambda added, removed: changes.append((added, removed)), 0)
+        assert sorted(watcher.words) == ['casă', 'eu']
+
+        write_bundle(bundle_path, ['eu', 'tu', 'masă'], truncate=True)
+
+        # Read again by every poll until it succeeds, even with nothing changed since
+        for _ in range(2):
+            try:
+                watcher.poll()
+                assert False, 'a truncated bundle must not be read'
+            except ValueError:
+                pass
+
+        write_bundle(bundle_path, ['eu', 'tu', 'masă'])
+        watcher.poll()
+        assert changes == [(['tu', 'masă'], [])]
+
+        watcher.poll()
+        assert len(changes) == 1
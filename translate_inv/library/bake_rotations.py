@@ -0,0 +1,275 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import calc_R, skeleton
+from .calc_R import IKSolver
+from .helpers import bones_mapper, clip_format, landmark_bundle, landmarks_smoother, rotation_clip, three
+from .helpers.filters import kalman, moving_average
+from .helpers.landmarks_smoother import get_smoothed, landmarks_digest, list_words
+from .helpers.rotation_clip import rotation_clip_path, write_rotation_clip
+from .skeleton import Skeleton
+
+
+# The smoothness the app lets the user pick
+default_window_sizes = range(1, 11)
+
+# Kept in the output directory: word -> digest of everything its rotation clips were baked from
+manifest_name = 'bake_manifest.json'
+
+# The code the rotations depend on, from decoding the landmarks to writing the clips, so that
+# e.g. changing a filter parameter rebakes every word
+_pipeline_modules = [
+    clip_format, landmark_bundle, landmarks_smoother, kalman, moving_average,
+    three, bones_mapper, skeleton, calc_R, rotation_clip
+]
+
+_stages = ['load', 'trim', 'kalman', 'smooth', 'ik', 'write']
+
+# State of a worker process, set once by _init_worker
+_solver: IKSolver | None = None
+_job: tuple | None = None
+
+
+def bake_word(
+    solver: IKSolver,
+    landmarks_dir: str,
+    word: str,
+    window_size: int,
+    out_dir: str,
+    half: bool = False,
+    timings: dict[str, float] | None = None
+) -> str:
+    """
+    Solves the rotations of every frame of word's landmarks smoothed with window_size, writes
+    them as a rotation clip in out_dir and returns its path.
+
+    If timings is given, the seconds spent in each stage are added to it, by stage name.
+    """
+
+    timings = {} if timings is None else timings
+
+    # Before the smoothing, so that landmarks changing meanwhile leave a clip the app rejects
+    digest = landmarks_digest(landmarks_dir, word)
+    fps, frames = get_smoothed(landmarks_dir, word, window_size, steady_state=True, timings=timings)
+
+    start = time.perf_counter()
+    rotations = solver.solve_clip(frames[0], frames[1], frames[2])
+    timings['ik'] = timings.get('ik', 0) + time.perf_counter() - start
+
+    start = time.perf_counter()
+    path = rotation_clip_path(out_dir, word, window_size)
+    write_rotation_clip(path, rotations, fps, window_size, solver.skeleton.rig_digest, digest, half)
+    timings['write'] = timings.get('write', 0) + time.perf_counter() - start
+
+    return path
+
+
+def pipeline_digest() -> str:
+    digest = hashlib.md5()
+
+    for module in _pipeline_modules:
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def _read_manifest(out_dir: str) -> dict[str, str]:
+    try:
+        with open(os.path.join(out_dir, manifest_name), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(out_dir: str, manifest: dict[str, str]) -> None:
+    fd, temp_path = tempfile.mkstemp(dir=out_dir)
+
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+
+        os.replace(temp_path, os.path.join(out_dir, manifest_name))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _init_worker(char_path: str, landmarks_dir: str, out_dir: str, window_sizes: list[int], half: bool) -> None:
+    global _solver, _job
+
+    # Parsed once per worker, not once per word
+    _solver = IKSolver(Skeleton(char_path))
+    _job = (landmarks_dir, out_dir, window_sizes, half)
+
+
+def _bake_chunk(words: list[str]) -> tuple[list[str], dict[str, str], dict[str, float]]:
+    """
+    Bakes every window size of the words, and returns those that were baked, the errors of
+    the others by word, and the seconds spent in each stage.
+    """
+
+    landmarks_dir, out_dir, window_sizes, half = _job
+
+    baked = []
+    errors = {}
+    timings = {}
+
+    for word in words:
+        try:
+            # Window sizes innermost, so the stages before the moving average are cached
+            for window_size in window_sizes:
+                bake_word(_solver, landmarks_dir, word, window_size, out_dir, half, timings)
+        except Exception as e:
+            errors[word] = repr(e)
+        else:
+            baked.append(word)
+
+    return baked, errors, timings
+
+
+def bake(
+    char_path: str,
+    landmarks_dir: str,
+    out_dir: str,
+    window_sizes=default_window_sizes,
+    words=None,
+    half: bool = False,
+    workers: int | None = None,
+    chunk_size: int | None = None,
+    force: bool = False,
+    progress=None
+) -> tuple[list[str], list[str], dict[str, str], dict[str, float]]:
+    """
+    Bakes the rotation clips of the character for the words, all those of landmarks_dir if not
+    given, and every window size, over workers processes, all the cores if not given.
+
+    Words whose landmarks, rig, settings and pipeline code are the same as when they were last
+    baked into out_dir are skipped, unless force is set. progress, if given, is called with the
+    number of words done and to do, after every chunk.
+
+    Returns the words baked, the words skipped, the errors of the words that failed, by word,
+    and the seconds spent in each stage, summed over all the workers.
+
+    The app looks for the rotation clips in rotation/<character>/ of its data directory.
+    """
+
+    window_sizes = list(window_sizes)
+
+    if words is None:
+        words = list_words(landmarks_dir)
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    settings = hashlib.md5(json.dumps([
+        pipeline_digest(), Skeleton(char_path).rig_digest.hex(), window_sizes, half
+    ]).encode('utf-8')).hexdigest()
+
+    manifest = _read_manifest(out_dir)
+    digests = {}
+    errors = {}
+    skipped = []
+    to_bake = []
+
+    for word in words:
+        try:
+            digests[word] = hashlib.md5((settings + landmarks_digest(landmarks_dir, word)).encode('utf-8')).hexdigest()
+        except (OSError, ValueError) as e:
+            errors[word] = repr(e)
+            continue
+
+        up_to_date = manifest.get(word) == digests[word] and all(
+            os.path.isfile(rotation_clip_path(out_dir, word, window_size)) for window_size in window_sizes
+        )
+
+        if up_to_date and not force:
+            skipped.append(word)
+        else:
+            to_bake.append(word)
+
+    workers = workers or os.cpu_count() or 1
+    # Small enough chunks to keep every worker busy until the end, large enough to amortize the IPC
+    chunk_size = chunk_size or max(1, min(32, len(to_bake) // (4 * workers)))
+    chunks = [to_bake[i:i + chunk_size] for i in range(0, len(to_bake), chunk_size)]
+
+    baked = []
+    done = 0
+    timings = dict.fromkeys(_stages, 0.0)
+    init_args = (char_path, landmarks_dir, out_dir, window_sizes, half)
+
+    def collect(result):
+        nonlocal done
+        chunk_baked, chunk_errors, chunk_timings = result
+
+        done += len(chunk_baked) + len(chunk_errors)
+        baked.extend(chunk_baked)
+        errors.update(chunk_errors)
+
+        for word in chunk_baked:
+            manifest[word] = digests[word]
+
+        for stage, seconds in chunk_timings.items():
+            timings[stage] = timings.get(stage, 0) + seconds
+
+        if progress is not None:
+            progress(done, len(to_bake))
+
+    try:
+        if workers == 1 or len(chunks) <= 1:
+            _init_worker(*init_args)
+
+            for chunk in chunks:
+                collect(_bake_chunk(chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as pool:
+                for future in as_completed([pool.submit(_bake_chunk, chunk) for chunk in chunks]):
+                    collect(future.result())
+    finally:
+        # Whatever was baked before an interruption is not baked again
+        _write_manifest(out_dir, manifest)
+
+    return baked, skipped, errors, timings
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description='Bakes the bone rotations of landmark clips for a character.')
+    parser.add_argument('char_path', help='GLB file of the character')
+    parser.add_argument('landmarks_dir', help='directory of the landmark clips')
+    parser.add_argument('out_dir', help='directory the rotation clips are written to')
+    parser.add_argument('--window-sizes', type=int, nargs='+', default=list(default_window_sizes))
+    parser.add_argument('--words', nargs='+', help='only these words, instead of all of landmarks_dir')
+    parser.add_argument('--half', action='store_true', help='store the rotations as float16')
+    parser.add_argument('--workers', type=int, help='number of processes, all the cores by default')
+    parser.add_argument('--chunk-size', type=int, help='words handed to a worker at once')
+    parser.add_argument('--force', action='store_true', help='also rebake the words that did not change')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+
+    baked, skipped, errors, timings = bake(
+        args.char_path, args.landmarks_dir, args.out_dir, args.window_sizes, args.words, args.half,
+        args.workers, args.chunk_size, args.force,
+        progress=lambda done, total: print(f'{done}/{total} words', flush=True)
+    )
+
+    wall_seconds = time.perf_counter() - start
+
+    for word, error in errors.items():
+        print(f'{word}: {error}')
+
+    print(f'{len(baked)} words baked, {len(skipped)} unchanged, {len(errors)} failed, in {wall_seconds:.2f}s')
+
+    # CPU time over all the workers, so it may well exceed the wall time
+    total_seconds = sum(timings.values()) or 1
+    for stage, seconds in timings.items():
+        print(f'  {stage:<8}{seconds:10.3f}s {100 * seconds / total_seconds:5.1f}%')
+
+
+if __name__ == '__main__':
+    main()
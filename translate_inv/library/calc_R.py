@@ -1,13 +1,19 @@
 import numpy as np
+import threading
+import weakref
 
 from .helpers.math_types import *
 from .helpers.three import *
-from .skeleton import Skeleton
+from .skeleton import Rig, Skeleton
 
 
 null_lm_quat = np.array([0, 0, 0, 0.5])
 
-_bones_Q = dict()
+_landmarks_dist_from_cam = 1.5
+_landmarks_offset = np.array([1, 0, -1.5])
+
+# Width of the unprojected near plane, used to scale the landmarks' depth
+_x_scale = np.abs((unproject(np.array([1, -1, -1])) - unproject(np.array([-1, 1, -1])))[0])
 
 
 def compute_R(a: Vec3, b: Vec3) -> Mat4:
@@ -49,16 +55,13 @@ def Q_and_R_by_calculating_joints(
 
 
 def calc_hand_R(
-    skeleton: Skeleton,
+    rig: Rig,
     hand_landmarks: VecNx3,
-    handedness: Literal['Left', 'Right'],
-    R_low_arm: Mat4
+    side: int,
+    R_low_arm: Mat4,
+    result: VecNx4
 ) -> None:
-    hand_name = f'{handedness}Hand'
-    hand_lm = skeleton.get_landmark(hand_name, hand_landmarks)
-    index1_lm = skeleton.get_landmark(f'{handedness}Index1', hand_landmarks)
-    middle1_lm = skeleton.get_landmark(f'{handedness}Middle1', hand_landmarks)
-    pinky1_lm = skeleton.get_landmark(f'{handedness}Pinky1', hand_landmarks)
+    hand_lm, index1_lm, middle1_lm, pinky1_lm = hand_landmarks[rig.palm_landmarks]
 
     dir_hand_lm = middle1_lm - hand_lm
     dir_index_to_pinky_lm = pinky1_lm - index1_lm
@@ -68,94 +71,71 @@ def calc_hand_R(
     hand_lm_u = np.cross(hand_lm_v, hand_lm_w)
     R_hand_lm = make_basis(hand_lm_u, hand_lm_v, hand_lm_w)
 
-    dir_index_to_pinky_bone = normalize(skeleton.get_translation(f'{handedness}Pinky1') - skeleton.get_translation(f'{handedness}Index1'))
-
-    hand_bone_v = normalize(skeleton.get_translation(f'{handedness}Middle1'))
-    hand_bone_w = np.cross(dir_index_to_pinky_bone, hand_bone_v)
-    hand_bone_u = np.cross(hand_bone_v, hand_bone_w)
-    R_hand_bone = make_basis(hand_bone_u, hand_bone_v, hand_bone_w)
-
-    R_bone_to_lm = mult_mat(R_hand_lm, R_hand_bone.transpose())
+    R_bone_to_lm = mult_mat(R_hand_lm, rig.hand_bind[side].transpose())
     R_to_T_pose = R_low_arm.transpose()
     R_hand = mult_mat(R_to_T_pose, R_bone_to_lm)
     Q_hand = Q_from_R(R_hand)
     R_hand = mult_mat(R_low_arm, R_from_Q(Q_hand))
-    _bones_Q[hand_name] = Q_hand
-
-    R_chain_thumb = np.copy(R_hand)
-    R_chain_index = np.copy(R_hand)
-    R_chain_middle = np.copy(R_hand)
-    R_chain_ring = np.copy(R_hand)
-    R_chain_pinky = np.copy(R_hand)
+    result[rig.hand_bones[side]] = Q_hand
 
-    R_chains = [R_chain_thumb, R_chain_index, R_chain_middle, R_chain_ring, R_chain_pinky]
-
-    fingers = ['Thumb', 'Index', 'Middle', 'Ring', 'Pinky']
+    finger_landmarks = hand_landmarks[rig.finger_landmarks]
+    finger_rest = rig.finger_rest[side]
+    finger_bones = rig.finger_bones[side]
 
     for i in range(5):
-        for j in range(1, 4, 1):
-            bone_name = f'{handedness}{fingers[i]}{j}'
-            next_bone_name = f'{handedness}{fingers[i]}{j + 1}'
-
-            R_chain = R_chains[i]
-
-            joint_landmark = skeleton.get_landmark(bone_name, hand_landmarks)
-            joint_child_landmark = skeleton.get_landmark(next_bone_name, hand_landmarks)
+        R_chain = R_hand
 
-            joint_child = skeleton.get_translation(next_bone_name)
-
-            Q, R = Q_and_R_by_calculating_joints(joint_landmark, joint_child_landmark, joint_child, R_chain)
-            R_chains[i] = R
-            _bones_Q[bone_name] = Q
+        for j in range(3):
+            Q, R_chain = Q_and_R_by_calculating_joints(
+                finger_landmarks[i, j],
+                finger_landmarks[i, j + 1],
+                finger_rest[i, j],
+                R_chain
+            )
+            result[finger_bones[i, j]] = Q
 
 
 def calc_arm_R(
-    skeleton: Skeleton,
+    rig: Rig,
     pose_landmarks: VecNx3,
-    handedness: Literal['Left', 'Right'],
+    side: int,
     shoulder_inside: Vec3,
-    shoulder_lm: Vec3,
-    R_hips: Mat4
+    R_hips: Mat4,
+    result: VecNx4
 ) -> Mat4:
-    shoulder_name = f'{handedness}Shoulder'
-    up_arm_name = f'{handedness}UpArm'
-    low_arm_name = f'{handedness}LowArm'
-    hand_name = f'{handedness}Hand'
-
-    up_arm_lm = skeleton.get_landmark(up_arm_name, pose_landmarks)
+    shoulder_lm, up_arm_lm, low_arm_lm = pose_landmarks[rig.arm_landmarks[side]]
+    arm_rest = rig.arm_rest[side]
+    arm_bones = rig.arm_bones[side]
 
     Q_shoulder, R_shoulder = Q_and_R_by_calculating_joints(
         shoulder_inside,
         shoulder_lm,
-        skeleton.get_translation(up_arm_name),
+        arm_rest[0],
         R_hips
     )
-    _bones_Q[shoulder_name] = Q_shoulder
+    result[arm_bones[0]] = Q_shoulder
 
     Q_up_arm, R_up_arm = Q_and_R_by_calculating_joints(
         shoulder_lm,
         up_arm_lm,
-        skeleton.get_translation(low_arm_name),
+        arm_rest[1],
         R_shoulder
     )
-    _bones_Q[up_arm_name] = Q_up_arm
+    result[arm_bones[1]] = Q_up_arm
 
     Q_low_arm, R_low_arm = Q_and_R_by_calculating_joints(
         up_arm_lm,
-        skeleton.get_landmark(low_arm_name, pose_landmarks),
-        skeleton.get_translation(hand_name),
+        low_arm_lm,
+        arm_rest[2],
         R_up_arm
     )
-    _bones_Q[low_arm_name] = Q_low_arm
+    result[arm_bones[2]] = Q_low_arm
 
     return R_low_arm
 
 
 def update_landmarks(dist_from_cam: float, offset: Vec3, landmarks: VecNx3) -> None:
-    ip_lt = unproject(np.array([-1, 1, -1]))
-    ip_rb = unproject(np.array([1, -1, -1]))
-    ip_diff = ip_rb - ip_lt
-    x_scale = np.abs(ip_diff[0])
+    x_scale = _x_scale
 
     def proj_scale(p_ms: Vec3, cam_pos: Vec3, src_d: float, dst_d: float) -> Vec3:
         vec_cam2p = p_ms - cam_pos
@@ -172,27 +152,23 @@ def update_landmarks(dist_from_cam: float, offset: Vec3, landmarks: VecNx3) -> N
         np.copyto(lm, new_lm)
 
 
-def calc_R(
-    skeleton: Skeleton,
+def _calc_R(
+    rig: Rig,
     pose: VecNx3,
     left_hand: VecNx3,
     right_hand: VecNx3,
-) -> VecNx4:
-    pose = np.array(pose, np.float64)
-    left_hand = np.array(left_hand, np.float64)
-    right_hand = np.array(right_hand, np.float64)
-
-    update_landmarks(1.5, np.array([1, 0, -1.5]), pose)
+    result: VecNx4
+) -> None:
+    # Works in place: the landmarks are overwritten, the rotations are written into result
+    result[:] = null_lm_quat
 
-    left_shoulder_lm = skeleton.get_landmark('LeftShoulder', pose)
-    right_shoulder_lm = skeleton.get_landmark('RightShoulder', pose)
+    update_landmarks(_landmarks_dist_from_cam, _landmarks_offset, pose)
 
-    left_up_leg_lm = skeleton.get_landmark('LeftUpLeg', pose)
-    right_up_leg_lm = skeleton.get_landmark('RightUpLeg', pose)
+    left_shoulder_lm, right_shoulder_lm, left_up_leg_lm, right_up_leg_lm, left_ear_lm, right_ear_lm = pose[rig.body_landmarks]
 
     center_shoulders = (left_shoulder_lm + right_shoulder_lm) / 2
     center_hips = (left_up_leg_lm + right_up_leg_lm) / 2
-    center_ears = (skeleton.get_landmark('LeftEar', pose) + skeleton.get_landmark('RightEar', pose)) / 2
+    center_ears = (left_ear_lm + right_ear_lm) / 2
 
     spine_vector = center_shoulders - center_hips
     length_spine = np.linalg.norm(spine_vector)
@@ -211,86 +187,402 @@ def calc_R(
     # Hips
 
     v_hip_to_left = normalize(left_up_leg_lm - hips)
-    R_hip_to_left = compute_R(skeleton.get_translation('LeftUpLeg'), v_hip_to_left)
+    R_hip_to_left = compute_R(rig.hips_rest[0], v_hip_to_left)
     Q_hip_to_left = Q_from_R(R_hip_to_left)
 
     v_hip_to_right = normalize(right_up_leg_lm - hips)
-    R_hip_to_right = compute_R(skeleton.get_translation('RightUpLeg'), v_hip_to_right)
+    R_hip_to_right = compute_R(rig.hips_rest[1], v_hip_to_right)
     Q_hip_to_right = Q_from_R(R_hip_to_right)
 
     v_hip_to_spine = normalize(spine - hips)
-    R_hip_to_spine = compute_R(skeleton.get_translation('Spine'), v_hip_to_spine)
+    R_hip_to_spine = compute_R(rig.hips_rest[2], v_hip_to_spine)
     Q_hip_to_spine = Q_from_R(R_hip_to_spine)
 
     Q_hips = slerp(Q_hip_to_spine, slerp(Q_hip_to_left, Q_hip_to_right, 0.5), 1 / 3)
     # R_hips = R_from_Q(skeleton.get_rotation('Hips'))
     # skeleton.set_rotation('Hips', Q_hips)
     R_hips = R_from_Q(Q_hips)
-    _bones_Q['Hips'] = Q_hips
+    result[rig.hips] = Q_hips
 
     # Neck
 
-    Q_neck, R_neck = Q_and_R_by_calculating_joints(neck, head, skeleton.get_translation('Head'), R_hips)
-    _bones_Q['Neck'] = Q_neck
+    Q_neck, R_neck = Q_and_R_by_calculating_joints(neck, head, rig.neck_rest, R_hips)
+    result[rig.neck] = Q_neck
+
+    if rig.eyes_rest is not None:
+        left_eye_lm, right_eye_lm = pose[rig.eye_landmarks]
 
-    try:
-        v_left_eye = normalize(skeleton.get_landmark('LeftEye', pose) - head)
+        v_left_eye = normalize(left_eye_lm - head)
         R_head_to_left_eye = compute_R(
-            skeleton.get_translation('LeftEye'),
+            rig.eyes_rest[0],
             apply_matrix_4(v_left_eye, R_neck.transpose())
         )
         Q_head_to_left_eye = Q_from_R(R_head_to_left_eye)
 
-        v_right_eye = normalize(skeleton.get_landmark('RightEye', pose) - head)
+        v_right_eye = normalize(right_eye_lm - head)
         R_head_to_right_eye = compute_R(
-            skeleton.get_translation('RightEye'),
+            rig.eyes_rest[1],
             apply_matrix_4(v_right_eye, R_neck.transpose())
         )
         Q_head_to_right_eye = Q_from_R(R_head_to_right_eye)
 
         Q_head = slerp(Q_head_to_left_eye, Q_head_to_right_eye, 0.5)
-        _bones_Q['Head'] = Q_head
-    except:
-        _bones_Q['Head'] = null_lm_quat
+        result[rig.head] = Q_head
+    else:
+        result[rig.head] = null_lm_quat
 
     # Left Shoulder-UpArm-LowArm
 
-    R_left_low_arm = calc_arm_R(
-        skeleton,
-        pose,
-        'Left',
-        left_shoulder_inside,
-        left_shoulder_lm,
-        R_hips
-    )
+    R_left_low_arm = calc_arm_R(rig, pose, 0, left_shoulder_inside, R_hips, result)
 
     # Right Shoulder-UpArm-LowArm
 
-    R_right_low_arm = calc_arm_R(
-        skeleton,
-        pose,
-        'Right',
-        right_shoulder_inside,
-        right_shoulder_lm,
-        R_hips
-    )
+    R_right_low_arm = calc_arm_R(rig, pose, 1, right_shoulder_inside, R_hips, result)
 
     # Left UpLeg-LowLeg-Foot
 
     # Right UpLeg-LowLeg-Foot
 
-    update_landmarks(1.5, np.array([1, 0, -1.5]), left_hand)
-    calc_hand_R(skeleton, left_hand, 'Left', R_left_low_arm)
+    update_landmarks(_landmarks_dist_from_cam, _landmarks_offset, left_hand)
+    calc_hand_R(rig, left_hand, 0, R_left_low_arm, result)
+
+    update_landmarks(_landmarks_dist_from_cam, _landmarks_offset, right_hand)
+    calc_hand_R(rig, right_hand, 1, R_right_low_arm, result)
+
+
+def compute_R_batch(a: VecNx3, b: VecNx3) -> MatNx4x4:
+    a = normalize_batch(a)
+    b = normalize_batch(b)
+    a, b = np.broadcast_arrays(a, b)
+
+    dot = np.sum(a * b, axis=-1)
+    cross_len = np.linalg.norm(np.cross(a, b), axis=-1)
+
+    u = a
+    v = normalize_batch(b - dot[..., np.newaxis] * a)
+    w = normalize_batch(np.cross(b, a))
+
+    C = np.swapaxes(make_basis_batch(u, v, w), -1, -2)
 
-    update_landmarks(1.5, np.array([1, 0, -1.5]), right_hand)
-    calc_hand_R(skeleton, right_hand, 'Right', R_right_low_arm)
+    R_uvw = np.zeros(dot.shape + (4, 4))
+    R_uvw[..., 0, 0] = dot
+    R_uvw[..., 0, 1] = cross_len
+    R_uvw[..., 1, 0] = -cross_len
+    R_uvw[..., 1, 1] = dot
+    R_uvw[..., 2, 2] = 1
+    R_uvw[..., 3, 3] = 1
 
-    result = np.repeat([[0, 0, 0, 0.5]], 41, axis=0)
+    return mult_mat_batch(mult_mat_batch(np.swapaxes(C, -1, -2), R_uvw), C)
 
-    for key, value in _bones_Q.items():
-        result[skeleton.get_mapped_index(key)] = value
 
-    return result
+def Q_and_R_by_calculating_joints_batch(
+    joint_landmark: VecNx3,
+    joint_child_landmark: VecNx3,
+    joint_child: Vec3,
+    R_chain: MatNx4x4
+) -> tuple[VecNx4, MatNx4x4]:
+    direction = normalize_batch(joint_child_landmark - joint_landmark)
+    R = compute_R_batch(
+        joint_child,
+        apply_matrix_4_batch(direction, np.swapaxes(R_chain, -1, -2))
+    )
+
+    return Q_from_R_batch(R), mult_mat_batch(R_chain, R)
+
+
+def calc_hand_R_batch(
+    rig: Rig,
+    hand_landmarks: VecNxNx3,
+    side: int,
+    R_low_arm: MatNx4x4,
+    result: VecNxNx4
+) -> None:
+    palm_landmarks = hand_landmarks[..., rig.palm_landmarks, :]
+    hand_lm, index1_lm, middle1_lm, pinky1_lm = np.moveaxis(palm_landmarks, -2, 0)
+
+    dir_hand_lm = middle1_lm - hand_lm
+    dir_index_to_pinky_lm = pinky1_lm - index1_lm
+
+    hand_lm_v = normalize_batch(dir_hand_lm)
+    hand_lm_w = np.cross(normalize_batch(dir_index_to_pinky_lm), hand_lm_v)
+    hand_lm_u = np.cross(hand_lm_v, hand_lm_w)
+    R_hand_lm = make_basis_batch(hand_lm_u, hand_lm_v, hand_lm_w)
+
+    R_bone_to_lm = mult_mat_batch(R_hand_lm, rig.hand_bind[side].transpose())
+    R_to_T_pose = np.swapaxes(R_low_arm, -1, -2)
+    R_hand = mult_mat_batch(R_to_T_pose, R_bone_to_lm)
+    Q_hand = Q_from_R_batch(R_hand)
+    R_hand = mult_mat_batch(R_low_arm, R_from_Q_batch(Q_hand))
+    result[..., rig.hand_bones[side], :] = Q_hand
+
+    # All five fingers are solved together, one joint level at a time
+    finger_landmarks = hand_landmarks[..., rig.finger_landmarks, :]
+    R_chain = R_hand[..., np.newaxis, :, :]
+
+    for j in range(3):
+        Q, R_chain = Q_and_R_by_calculating_joints_batch(
+            finger_landmarks[..., j, :],
+            finger_landmarks[..., j + 1, :],
+            rig.finger_rest[side, :, j],
+            R_chain
+        )
+        result[..., rig.finger_bones[side, :, j], :] = Q
+
+
+def calc_arm_R_batch(
+    rig: Rig,
+    pose_landmarks: VecNxNx3,
+    side: int,
+    shoulder_inside: VecNx3,
+    R_hips: MatNx4x4,
+    result: VecNxNx4
+) -> MatNx4x4:
+    arm_landmarks = pose_landmarks[..., rig.arm_landmarks[side], :]
+    shoulder_lm, up_arm_lm, low_arm_lm = np.moveaxis(arm_landmarks, -2, 0)
+    arm_rest = rig.arm_rest[side]
+    arm_bones = rig.arm_bones[side]
+
+    Q_shoulder, R_shoulder = Q_and_R_by_calculating_joints_batch(
+        shoulder_inside,
+        shoulder_lm,
+        arm_rest[0],
+        R_hips
+    )
+    result[..., arm_bones[0], :] = Q_shoulder
+
+    Q_up_arm, R_up_arm = Q_and_R_by_calculating_joints_batch(
+        shoulder_lm,
+        up_arm_lm,
+        arm_rest[1],
+        R_shoulder
+    )
+    result[..., arm_bones[1], :] = Q_up_arm
+
+    Q_low_arm, R_low_arm = Q_and_R_by_calculating_joints_batch(
+        up_arm_lm,
+        low_arm_lm,
+        arm_rest[2],
+        R_up_arm
+    )
+    result[..., arm_bones[2], :] = Q_low_arm
+
+    return R_low_arm
+
+
+def update_landmarks_batch(dist_from_cam: float, offset: Vec3, landmarks: VecNxNx3) -> None:
+    x_scale = _x_scale
+
+    ndc = np.zeros(landmarks.shape)
+    ndc[..., 0] = (landmarks[..., 0] - 0.5) * 2
+    ndc[..., 1] = -(landmarks[..., 1] - 0.5) * 2
+
+    new_lm = unproject_batch(ndc)
+    new_lm[..., 2] = -landmarks[..., 2] * x_scale - camera_near + camera_position[2]
+    new_lm = camera_position + (new_lm - camera_position) * (dist_from_cam / camera_near)
+    new_lm += offset
+
+    np.copyto(landmarks, new_lm)
+
+
+def _calc_R_clip(
+    rig: Rig,
+    pose: VecNxNx3,
+    left_hand: VecNxNx3,
+    right_hand: VecNxNx3,
+    result: VecNxNx4
+) -> None:
+    # Same as _calc_R, but for every frame of a (T, N, 3) clip at once
+    result[:] = null_lm_quat
+
+    update_landmarks_batch(_landmarks_dist_from_cam, _landmarks_offset, pose)
+
+    body_landmarks = np.moveaxis(pose[:, rig.body_landmarks], 1, 0)
+    left_shoulder_lm, right_shoulder_lm, left_up_leg_lm, right_up_leg_lm, left_ear_lm, right_ear_lm = body_landmarks
+
+    center_shoulders = (left_shoulder_lm + right_shoulder_lm) / 2
+    center_hips = (left_up_leg_lm + right_up_leg_lm) / 2
+    center_ears = (left_ear_lm + right_ear_lm) / 2
+
+    spine_vector = center_shoulders - center_hips
+    length_spine = np.linalg.norm(spine_vector, axis=-1, keepdims=True)
+    dir_spine = normalize_batch(spine_vector)
+    hips = center_hips + dir_spine * length_spine / 9
+    spine = center_hips + dir_spine * length_spine / 9 * 3
+
+    shoulders_vector = right_shoulder_lm - left_shoulder_lm
+    neck = center_shoulders + dir_spine * length_spine / 9
+    left_shoulder_inside = left_shoulder_lm + shoulders_vector * 1 / 3
+    right_shoulder_inside = left_shoulder_lm + shoulders_vector * 2 / 3
+
+    head_vector = center_ears - neck
+    head = neck + head_vector * 0.5
+
+    # Hips
+
+    v_hip_to_left = normalize_batch(left_up_leg_lm - hips)
+    R_hip_to_left = compute_R_batch(rig.hips_rest[0], v_hip_to_left)
+    Q_hip_to_left = Q_from_R_batch(R_hip_to_left)
+
+    v_hip_to_right = normalize_batch(right_up_leg_lm - hips)
+    R_hip_to_right = compute_R_batch(rig.hips_rest[1], v_hip_to_right)
+    Q_hip_to_right = Q_from_R_batch(R_hip_to_right)
+
+    v_hip_to_spine = normalize_batch(spine - hips)
+    R_hip_to_spine = compute_R_batch(rig.hips_rest[2], v_hip_to_spine)
+    Q_hip_to_spine = Q_from_R_batch(R_hip_to_spine)
+
+    Q_hips = slerp_batch(Q_hip_to_spine, slerp_batch(Q_hip_to_left, Q_hip_to_right, 0.5), 1 / 3)
+    R_hips = R_from_Q_batch(Q_hips)
+    result[:, rig.hips] = Q_hips
+
+    # Neck
+
+    Q_neck, R_neck = Q_and_R_by_calculating_joints_batch(neck, head, rig.neck_rest, R_hips)
+    result[:, rig.neck] = Q_neck
+
+    if rig.eyes_rest is not None:
+        left_eye_lm, right_eye_lm = np.moveaxis(pose[:, rig.eye_landmarks], 1, 0)
+
+        v_left_eye = normalize_batch(left_eye_lm - head)
+        R_head_to_left_eye = compute_R_batch(
+            rig.eyes_rest[0],
+            apply_matrix_4_batch(v_left_eye, np.swapaxes(R_neck, -1, -2))
+        )
+        Q_head_to_left_eye = Q_from_R_batch(R_head_to_left_eye)
+
+        v_right_eye = normalize_batch(right_eye_lm - head)
+        R_head_to_right_eye = compute_R_batch(
+            rig.eyes_rest[1],
+            apply_matrix_4_batch(v_right_eye, np.swapaxes(R_neck, -1, -2))
+        )
+        Q_head_to_right_eye = Q_from_R_batch(R_head_to_right_eye)
+
+        result[:, rig.head] = slerp_batch(Q_head_to_left_eye, Q_head_to_right_eye, 0.5)
+    else:
+        result[:, rig.head] = null_lm_quat
+
+    # Left Shoulder-UpArm-LowArm
+
+    R_left_low_arm = calc_arm_R_batch(rig, pose, 0, left_shoulder_inside, R_hips, result)
+
+    # Right Shoulder-UpArm-LowArm
+
+    R_right_low_arm = calc_arm_R_batch(rig, pose, 1, right_shoulder_inside, R_hips, result)
+
+    update_landmarks_batch(_landmarks_dist_from_cam, _landmarks_offset, left_hand)
+    calc_hand_R_batch(rig, left_hand, 0, R_left_low_arm, result)
+
+    update_landmarks_batch(_landmarks_dist_from_cam, _landmarks_offset, right_hand)
+    calc_hand_R_batch(rig, right_hand, 1, R_right_low_arm, result)
+
+
+class IKSolver:
+    """
+    Computes the bones' rotations for one skeleton.
+
+    Owns the buffers the landmarks are copied and transformed in and the rotations are written
+    to, so those are not allocated again for every frame or clip; the math in between still
+    makes its own small temporaries. An instance is not thread safe, use one per thread;
+    different instances (even for the same skeleton) share no state.
+    """
+
+    def __init__(self, skeleton: Skeleton) -> None:
+        self.skeleton = skeleton
+
+        self._result = np.empty((41, 4))
+        self._landmarks = [np.empty((0, 3)) for _ in range(3)]
+        self._clip_landmarks = [np.empty((0, 0, 3)) for _ in range(3)]
+
+
+    def solve(
+        self,
+        pose: VecNx3,
+        left_hand: VecNx3,
+        right_hand: VecNx3,
+        out: VecNx4 | None = None
+    ) -> VecNx4:
+        """
+        Returns the (41, 4) rotations for one frame.
+
+        Without out, the returned array is owned by the solver and is overwritten by the next call.
+        """
+
+        result = self._result if out is None else out
+        pose, left_hand, right_hand = self._copy_landmarks(self._landmarks, pose, left_hand, right_hand)
+
+        _calc_R(self.skeleton.rig, pose, left_hand, right_hand, result)
+
+        return result
+
+
+    def solve_clip(
+        self,
+        pose: VecNxNx3,
+        left_hand: VecNxNx3,
+        right_hand: VecNxNx3,
+        out: VecNxNx4 | None = None
+    ) -> VecNxNx4:
+        """Returns the (T, 41, 4) rotations for every frame of a clip."""
+
+        pose, left_hand, right_hand = self._copy_landmarks(self._clip_landmarks, pose, left_hand, right_hand)
+
+        result = np.empty((pose.shape[0], 41, 4)) if out is None else out
+
+        _calc_R_clip(self.skeleton.rig, pose, left_hand, right_hand, result)
+
+        return result
+
+
+    @staticmethod
+    def _copy_landmarks(buffers: list[np.ndarray], *landmarks: VecNx3) -> list[np.ndarray]:
+        # The landmarks are transformed in place, so they are copied, as float64, into buffers
+        # that are only reallocated when the shape changes
+        for i, value in enumerate(landmarks):
+            value = np.asarray(value)
+
+            if buffers[i].shape != value.shape:
+                buffers[i] = np.empty(value.shape)
+
+            np.copyto(buffers[i], value)
+
+        return buffers
+
+
+# The solvers of calc_R and calc_R_clip, one per skeleton and thread
+_solvers = threading.local()
+
+
+def _get_solver(skeleton: Skeleton) -> IKSolver:
+    solvers = getattr(_solvers, 'by_skeleton', None)
+
+    if solvers is None:
+        solvers = _solvers.by_skeleton = weakref.WeakKeyDictionary()
+
+    solver = solvers.get(skeleton)
+
+    if solver is None:
+        solver = solvers[skeleton] = IKSolver(skeleton)
+
+    return solver
+
+
+def calc_R(
+    skeleton: Skeleton,
+    pose: VecNx3,
+    left_hand: VecNx3,
+    right_hand: VecNx3,
+) -> VecNx4:
+    # The caller keeps the rotations, so they are not left in the shared solver's buffer
+    return _get_solver(skeleton).solve(pose, left_hand, right_hand, np.empty((41, 4)))
+
+
+def calc_R_clip(
+    skeleton: Skeleton,
+    pose: VecNxNx3,
+    left_hand: VecNxNx3,
+    right_hand: VecNxNx3,
+) -> VecNxNx4:
+    return _get_solver(skeleton).solve_clip(pose, left_hand, right_hand)
 
 
 if __name__ == '__main__':
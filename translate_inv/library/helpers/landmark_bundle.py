@@ -0,0 +1,264 @@
+import glob
+import hashlib
+import json
+import mmap
+import numpy as np
+import os
+import re
+import struct
+import tempfile
+
+from .clip_format import Clip, clip_extension, dtypes, encode, num_landmarks, read_clip
+from .math_types import *
+
+
+# A bundle is a single file holding the clips of many words:
+#   header, little endian: magic, version, length of the index
+#   index, JSON: {"entries": {word: entry}, "removed": [word]}
+#   data: the landmarks of every clip, as in a clip file, each starting at a multiple of 64 bytes
+# An entry holds the offset of the landmarks of its clip from the start of the data, along with
+# the number of frames, fps, dtype, scale and presence ranges of the hands of the clip.
+# A bundle with removed words is a delta, to be applied to a full bundle by apply_delta.
+_magic = b'LSBN'
+_version = 1
+_header = struct.Struct('<4sHxxQ')
+_alignment = 64
+
+bundle_name = 'landmarks.bundle'
+
+
+def _align(n: int) -> int:
+    return -(-n // _alignment) * _alignment
+
+
+class LandmarkBundle:
+    """
+    A bundle, memory mapped as a whole, handing out clips whose landmarks are views of the mapping,
+    so the pages are shared by all the processes reading the same bundle.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self.mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < _header.size:
+            raise ValueError(f'{path} is not a bundle')
+
+        magic, version, index_length = _header.unpack_from(self._mmap)
+
+        if magic != _magic:
+            raise ValueError(f'{path} is not a bundle')
+
+        if version != _version:
+            raise ValueError(f'{path} is a version {version} bundle, only version {_version} is supported')
+
+        index = json.loads(self._mmap[_header.size:_header.size + index_length].decode('utf-8'))
+
+        self._entries: dict[str, dict] = index['entries']
+        self.removed: list[str] = index.get('removed', [])
+        self._data_offset = _align(_header.size + index_length)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __getitem__(self, word: str) -> Clip:
+        entry = self._entries[word]
+
+        data = np.frombuffer(
+            self._mmap,
+            dtype=dtypes[entry['dtype']],
+            count=entry['frames'] * num_landmarks * 3,
+            offset=self._data_offset + entry['offset']
+        )
+
+        return Clip(
+            entry['fps'],
+            data.reshape(entry['frames'], num_landmarks, 3),
+            np.array(entry['scale'], dtype=np.float32),
+            tuple(entry['left_range']),
+            tuple(entry['right_range'])
+        )
+
+    def get(self, word: str) -> Clip | None:
+        return self[word] if word in self._entries else None
+
+    def digest(self, word: str) -> str:
+        """
+        Returns a hash of the clip of word, as stored.
+        """
+
+        entry, data = self._raw(word)
+        entry = {key: value for key, value in entry.items() if key != 'offset'}
+
+        digest = hashlib.md5(json.dumps(entry, sort_keys=True).encode('utf-8'))
+        digest.update(data)
+
+        return digest.hexdigest()
+
+    def _raw(self, word: str) -> tuple[dict, memoryview]:
+        entry = self._entries[word]
+        start = self._data_offset + entry['offset']
+        size = entry['frames'] * num_landmarks * 3 * dtypes[entry['dtype']].itemsize
+
+        return entry, memoryview(self._mmap)[start:start + size]
+
+
+def _write(path: str, entries: list[tuple[str, dict, bytes]], removed: list[str]) -> None:
+    index = {'entries': {}, 'removed': removed}
+    offset = 0
+
+    for word, entry, data in entries:
+        index['entries'][word] = {**entry, 'offset': offset}
+        offset = _align(offset + len(data))
+
+    index = json.dumps(index, ensure_ascii=False).encode('utf-8')
+    header = _header.pack(_magic, _version, len(index))
+
+    # Written next to the bundle, then swapped in, so readers never see half of it
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.write(index)
+            f.write(b'\0' * (_align(_header.size + len(index)) - _header.size - len(index)))
+
+            for _, _, data in entries:
+                f.write(data)
+                f.write(b'\0' * (_align(len(data)) - len(data)))
+
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _encode_entry(frames: VecNxNxNx3, fps: int, quantize: bool) -> tuple[dict, bytes]:
+    data, scale, left_range, right_range = encode(frames, quantize)
+
+    entry = {
+        'frames': len(data),
+        'fps': fps,
+        'dtype': dtypes.index(data.dtype),
+        'scale': scale.tolist(),
+        'left_range': left_range,
+        'right_range': right_range
+    }
+
+    return entry, data.tobytes()
+
+
+def write_bundle(path: str, clips, quantize: bool = False, removed=()) -> None:
+    """
+    Writes the (word, legacy (3, T, 33, 3) landmarks, fps) clips as a bundle, or as a delta
+    when words are removed.
+    """
+
+    entries = []
+
+    for word, frames, fps in clips:
+        entry, data = _encode_entry(frames, fps, quantize)
+        entries.append((word, entry, data))
+
+    _write(path, entries, list(removed))
+
+
+def read_legacy_directory(directory: str):
+    """
+    Yields the (word, legacy landmarks, fps) clips of the <word>__fps<fps>.npy and <word>.clip
+    files of directory.
+    """
+
+    for path in sorted(glob.glob(os.path.join(directory, '*__fps*.npy'))):
+        match = re.fullmatch(r'(.*)__fps(\d+)\.npy', os.path.basename(path))
+        if match is not None:
+            yield match.group(1), np.load(path), int(match.group(2))
+
+    for path in sorted(glob.glob(os.path.join(directory, '*' + clip_extension))):
+        clip = read_clip(path)
+        yield os.path.basename(path)[:-len(clip_extension)], clip.to_legacy(), clip.fps
+
+
+def build_bundle(path: str, directory: str, quantize: bool = False) -> None:
+    write_bundle(path, read_legacy_directory(directory), quantize)
+
+
+def apply_delta(base_path: str, delta_path: str, out_path: str) -> None:
+    """
+    Writes to out_path the base bundle without the words the delta removes, and with the
+    clips of the delta added or replacing their old ones. The clips are copied, not decoded.
+    """
+
+    base = LandmarkBundle(base_path)
+    delta = LandmarkBundle(delta_path)
+
+    removed = set(delta.removed)
+    entries = []
+
+    for bundle, words in [
+        (base, [word for word in base if word not in removed and word not in delta]),
+        (delta, list(delta))
+    ]:
+        for word in words:
+            entry, data = bundle._raw(word)
+            entries.append((word, {key: value for key, value in entry.items() if key != 'offset'}, bytes(data)))
+
+    _write(out_path, entries, [])
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+
+    def random_clip(num_frames):
+        frames = np.zeros((3, num_frames, 33, 3), dtype=np.float32)
+        frames[0] = rng.random((num_frames, 33, 3))
+        frames[1, 1:, :21] = rng.random((num_frames - 1, 21, 3))
+        frames[2, :, :21] = rng.random((num_frames, 21, 3))
+        return frames
+
+    clips = {'casă': (random_clip(40), 30), 'eu': (random_clip(7), 25), 'a': (random_clip(1), 30)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for word, (frames, fps) in clips.items():
+            np.save(os.path.join(directory, f'{word}__fps{fps}.npy'), frames)
+
+        path = os.path.join(directory, bundle_name)
+        build_bundle(path, directory)
+        bundle = LandmarkBundle(path)
+
+        assert len(bundle) == 3 and sorted(bundle) == sorted(clips) and 'nu' not in bundle
+
+        for word, (frames, fps) in clips.items():
+            clip = bundle[word]
+
+            assert clip.fps == fps and not clip.quantized
+            assert np.array_equal(clip.to_legacy(), frames)
+            # A view of the mapping, not a copy
+            assert not clip.data.flags.owndata and not clip.data.flags.writeable
+            assert clip.data.ctypes.data % _alignment == 0
+
+        assert bundle['a'].left_range == (0, 0) and bundle['a'].right_range == (0, 1)
+
+        delta_path = os.path.join(directory, 'delta.bundle')
+        new_eu = random_clip(12)
+        write_bundle(delta_path, [('eu', new_eu, 60), ('nu', random_clip(3), 30)], quantize=True, removed=['a'])
+
+        updated_path = os.path.join(directory, 'updated.bundle')
+        apply_delta(path, delta_path, updated_path)
+        updated = LandmarkBundle(updated_path)
+
+        assert list(updated) == ['casă', 'eu', 'nu']
+        assert np.array_equal(updated['casă'].to_legacy(), clips['casă'][0])
+        assert updated['eu'].fps == 60 and updated['eu'].quantized
+        # Moving a clip around does not change its digest
+        assert updated.digest('casă') == bundle.digest('casă') and updated.digest('eu') != bundle.digest('eu')
+        assert np.allclose(updated['eu'].to_legacy(), new_eu, atol=1 / 32767)
@@ -1,136 +1,534 @@
 import glob
+import hashlib
 import numpy as np
 import os
 import re
+import threading
+import time
 
+from collections import OrderedDict
+
+from .clip_format import clip_extension, read_clip
+from .landmark_bundle import LandmarkBundle, bundle_name
 from .filters.kalman import *
 from .filters.moving_average import moving_average_smooth
 from .math_types import *
 
 
-def _process(frames: VecNxNx3, fps: int, start: int, stop: int) -> None:
+# Only the first 21 landmarks of a hand are meaningful, the rest is padding
+_num_hand_landmarks = 21
+
+# Upper bound on the memory taken by the smoothed clips kept around by get_smoothed
+_smoothed_cache_max_bytes = 32 * 1024 * 1024
+
+# (directory, word) -> (directory mtime, landmarks file or None), to avoid globbing the directory
+# for every repeated word. Adding, removing or renaming a file changes the directory mtime.
+_landmarks_files: dict[tuple[str, str], tuple[int, str | None]] = {}
+
+# bundle path -> bundle, reopened when the bundle is replaced
+_bundles: dict[str, LandmarkBundle] = {}
+
+
+def _process(frames: VecNxNx3, fps: int, start: int, stop: int, steady_state: bool = False) -> None:
+    _process_hands(frames[np.newaxis], fps, [(start, stop)], steady_state)
+
+
+def _process_hands(
+    hands: VecNxNxNx3,
+    fps: int,
+    start_stops: list[tuple[int, int]],
+    steady_state: bool = False
+) -> None:
+    """
+    Kalman filters, in place, the frames in [start + 2, stop) of each hand in hands (H, T, N, 3).
+
+    The filters of all the landmarks of all the hands are advanced together, one frame at a time.
+    With steady_state, the gains come from kalman_gain_schedule instead of being recomputed
+    from the covariances, which gives the same output up to rounding, without any matrix inversion.
+    """
+
+    if steady_state:
+        _process_hands_steady(hands, fps, start_stops)
+        return
+
     dt = 1 / fps
-    kalman_filters = [
-        kalman_init(frames[start][i], frames[start + 1][i], dt) for i in range(frames.shape[1])
+    n = _num_hand_landmarks
+
+    filters = [
+        kalman_init_batch(hand[start][:n], hand[start + 1][:n], dt) for hand, (start, _) in zip(hands, start_stops)
     ]
 
-    for i in range(start + 2, stop):
-        frame = frames[i]
+    A, H, Q, R, _, _ = filters[0]
+    P = np.concatenate([f[4] for f in filters])
+    x = np.concatenate([f[5] for f in filters])
+
+    # P of a missing landmark is set to a very large number
+    P_missing = np.diag([1000000] * 6)
+
+    first = min(start for start, _ in start_stops) + 2
+    last = max(stop for _, stop in start_stops)
+
+    for i in range(first, last):
+        hands_active = np.array([start + 2 <= i < stop for start, stop in start_stops])
+        active = np.repeat(hands_active, n)
+
+        measurements = hands[:, i, :n].reshape(-1, 3)
+        detected = measurements.any(axis=-1)
+
+        x_pred, P_pred = kalman_predict_batch(A, Q, P, x)
+
+        # Landmark is detected
+        updated = active & detected
+        if updated.any():
+            x[updated], P[updated] = kalman_update_batch(H, R, P_pred[updated], x_pred[updated], measurements[updated])
+
+        # Landmark is missing, use prediction
+        missing = active & ~detected
+        x[missing] = x_pred[missing]
+        P[missing] = P_missing
+
+        for h in np.flatnonzero(hands_active):
+            hands[h, i, :n] = x[h * n:(h + 1) * n, :3]
+
+
+def _process_hands_steady(hands: VecNxNxNx3, fps: int, start_stops: list[tuple[int, int]]) -> None:
+    dt = 1 / fps
+    n = _num_hand_landmarks
+
+    filters = [
+        kalman_init_batch(hand[start][:n], hand[start + 1][:n], dt) for hand, (start, _) in zip(hands, start_stops)
+    ]
+
+    A, H, _, _, _, _ = filters[0]
+    x = np.concatenate([f[5] for f in filters])
+
+    gains = kalman_gain_schedule(dt)
+    last_step = gains.shape[1] - 1
+
+    # Per landmark: which schedule it follows (0 after init, 1 after a reset)
+    # and how many updates it had since
+    schedule = np.zeros(len(x), int)
+    step = np.zeros(len(x), int)
+
+    first = min(start for start, _ in start_stops) + 2
+    last = max(stop for _, stop in start_stops)
+
+    for i in range(first, last):
+        hands_active = np.array([start + 2 <= i < stop for start, stop in start_stops])
+        active = np.repeat(hands_active, n)
+
+        measurements = hands[:, i, :n].reshape(-1, 3)
+        detected = measurements.any(axis=-1)
+
+        x_pred = x @ A.T
+
+        # Landmark is detected
+        updated = active & detected
+        if updated.any():
+            K = gains[schedule[updated], np.minimum(step[updated], last_step)]
+            x[updated] = kalman_update_steady_batch(K, H, x_pred[updated], measurements[updated])
+            step[updated] += 1
 
-        for j, landmark in enumerate(frame):
-            if j >= 21:
-                break
+        # Landmark is missing, use prediction and restart from the reset covariance
+        missing = active & ~detected
+        x[missing] = x_pred[missing]
+        schedule[missing] = 1
+        step[missing] = 0
 
-            A, H, Q, R, P, x = kalman_filters[j]
+        for h in np.flatnonzero(hands_active):
+            hands[h, i, :n] = x[h * n:(h + 1) * n, :3]
 
-            if landmark.any():
-                # Landmark is detected
-                x_pred, P_pred = kalman_predict(A, Q, P, x)
-                x_updated, P_updated = kalman_update(H, R, P_pred, x_pred, landmark)
-            else:
-                # Landmark is missing, use prediction
-                x_pred, _ = kalman_predict(A, Q, P, x)
-                # For missing landmarks, we only update the position with the prediction
-                x_updated = x_pred
-                # And set P to a very large number
-                P_updated = np.diag([1000000] * 6)
 
-            np.copyto(frames[i][j], x_updated[:3])
-            kalman_filters[j] = (A, H, Q, R, P_updated, x_updated)
+def _first_last(mask) -> tuple[int, int]:
+    """
+    Returns the indices of the first True of mask and past its last one, (len, len) if there is none.
+    """
+
+    if not mask.any():
+        return (len(mask), len(mask))
+
+    return (int(np.argmax(mask)), len(mask) - int(np.argmax(mask[::-1])))
 
 
 def _get_non_zero_indices(arr) -> tuple[int, int]:
-    first_non_zero = 0
-    last_non_zero = len(arr) - 1
+    return _first_last(arr.any(axis=tuple(range(1, arr.ndim))))
 
-    while first_non_zero <= last_non_zero and not arr[first_non_zero].any():
-        first_non_zero += 1
 
-    while last_non_zero >= first_non_zero and not arr[last_non_zero].any():
-        last_non_zero -= 1
+def _dot_2d(a, b):
+    # np.dot of every pair of 2D vectors, as a stack of (1, 2) @ (2, 1) products, which round
+    # like np.dot does, unlike the products written out or einsum, for float64
+    return (a[..., np.newaxis, :] @ b[..., :, np.newaxis])[..., 0, 0]
 
-    return (first_non_zero, last_non_zero + 1)
 
+def _hands_over_torso_mid(pose, percentage=0.5):
+    """
+    For every frame of pose (T, 33, 3), whether a hand is above the point of the torso that is
+    percentage of the way from the hips to the shoulders, along the spine.
+    """
 
-def _check_hands_over_torso_mid(pose, percentage=0.5):
-    mid_shoulders = (pose[11][:2] + pose[12][:2]) / 2
-    mid_hips = (pose[23][:2] + pose[24][:2]) / 2
+    mid_shoulders = (pose[:, 11, :2] + pose[:, 12, :2]) / 2
+    mid_hips = (pose[:, 23, :2] + pose[:, 24, :2]) / 2
 
     spine_dir = mid_shoulders - mid_hips
-    spine_dir /= np.linalg.norm(spine_dir)
+    spine_dir /= np.sqrt(_dot_2d(spine_dir, spine_dir))[:, np.newaxis]
 
-    l_mid_torso = pose[11][:2] * percentage + pose[23][:2] * (1 - percentage)
-    r_mid_torso = pose[12][:2] * percentage + pose[24][:2] * (1 - percentage)
+    l_mid_torso = pose[:, 11, :2] * percentage + pose[:, 23, :2] * (1 - percentage)
+    r_mid_torso = pose[:, 12, :2] * percentage + pose[:, 24, :2] * (1 - percentage)
 
-    left_hand = pose[15][:2]
-    right_hand = pose[16][:2]
+    left_hand = pose[:, 15, :2]
+    right_hand = pose[:, 16, :2]
 
-    l_mid_torso_proj = np.dot(l_mid_torso, spine_dir)
-    left_hand_proj = np.dot(left_hand, spine_dir)
+    l_mid_torso_proj = _dot_2d(l_mid_torso, spine_dir)
+    left_hand_proj = _dot_2d(left_hand, spine_dir)
 
-    r_mid_torso_proj = np.dot(r_mid_torso, spine_dir)
-    right_hand_proj = np.dot(right_hand, spine_dir)
+    r_mid_torso_proj = _dot_2d(r_mid_torso, spine_dir)
+    right_hand_proj = _dot_2d(right_hand, spine_dir)
 
-    return left_hand_proj >= l_mid_torso_proj or right_hand_proj >= r_mid_torso_proj
+    return (left_hand_proj >= l_mid_torso_proj) | (right_hand_proj >= r_mid_torso_proj)
 
 
 def _filter_useless(arr):
-    pose = arr[0]
+    start, stop = _first_last(_hands_over_torso_mid(arr[0], 0.2))
 
-    first_at_mid_torso = 0
-    last_at_mid_torso = arr.shape[1] - 1
+    return arr[:,start:stop]
 
-    while first_at_mid_torso <= last_at_mid_torso:
-        if _check_hands_over_torso_mid(pose[first_at_mid_torso], 0.2):
-            break
 
-        first_at_mid_torso += 1
+def _find_landmarks_file(directory: str, word: str) -> str | None:
+    key = (directory, word)
+    mtime = os.stat(directory).st_mtime_ns
+    entry = _landmarks_files.get(key)
 
-    while last_at_mid_torso >= first_at_mid_torso:
-        if _check_hands_over_torso_mid(pose[last_at_mid_torso], 0.2):
-            break
+    if entry is not None and entry[0] == mtime:
+        return entry[1]
 
-        last_at_mid_torso -= 1
+    # A packed clip, if the word was converted, else the legacy .npy
+    path = os.path.join(directory, word + clip_extension)
 
-    return arr[:,first_at_mid_torso:last_at_mid_torso + 1]
+    if not os.path.isfile(path):
+        pattern = os.path.join(directory, f'{word}__fps*.npy')
+        files = glob.glob(pattern)
 
+        path = os.path.join(directory, files[0]) if len(files) == 1 else None
+
+    _landmarks_files[key] = (mtime, path)
+
+    return path
+
+
+def _landmarks_source(directory: str, word: str) -> LandmarkBundle | str:
+    """
+    Returns the bundle of directory if it holds word, or else the file of word, or whichever
+    of the two was written last when there are both: a file updated on its own is used until
+    the bundle is rebuilt, and a rebuilt bundle over older files.
+    """
+
+    bundle = _get_bundle(directory)
+    path = _find_landmarks_file(directory, word)
+
+    if bundle is not None and word in bundle:
+        if path is None or bundle.mtime_ns >= os.stat(path).st_mtime_ns:
+            return bundle
+
+    if path is None:
+        raise ValueError(f'No landmarks for {word} in {directory}')
+
+    return path
+
+
+def list_words(directory: str) -> list[str]:
+    """
+    Returns the words with landmarks in directory, be they in its bundle or in files of their own.
+    """
+
+    bundle = _get_bundle(directory)
+    words = list(bundle) if bundle is not None else []
+
+    for file_name in sorted(os.listdir(directory)):
+        match = re.fullmatch(r'(.*)__fps\d+\.npy', file_name)
+
+        if match is not None:
+            words.append(match.group(1))
+        elif file_name.endswith(clip_extension):
+            words.append(file_name[:-len(clip_extension)])
+
+    return list(dict.fromkeys(words))
+
+
+def landmarks_digest(directory: str, word: str) -> str:
+    """
+    Returns a hash of the landmarks of word as stored, which changes whenever they do.
+    """
+
+    source = _landmarks_source(directory, word)
+
+    if isinstance(source, LandmarkBundle):
+        return source.digest(word)
+
+    landmarks_path = source
+    digest = hashlib.md5(os.path.basename(landmarks_path).encode('utf-8'))
+
+    with open(landmarks_path, 'rb') as f:
+        digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def _get_bundle(directory: str) -> LandmarkBundle | None:
+    path = os.path.join(directory, bundle_name)
+
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    bundle = _bundles.get(path)
+    if bundle is None or bundle.mtime_ns != mtime:
+        bundle = LandmarkBundle(path)
+        _bundles[path] = bundle
+
+    return bundle
 
-def save_smoothed(
-    directory: str,
-    word: str,
-    window_size: int
-) -> int:
-    pattern = os.path.join(directory, f'{word}__fps*.npy')
-    files = glob.glob(pattern)
 
-    if len(files) != 1:
-        raise ValueError()
+def _load_from_bundle(bundle: LandmarkBundle, word: str) -> tuple[int, VecNxNxNx3]:
+    clip = bundle[word]
 
-    file = files[0]
-    landmarks_path = os.path.join(directory, file)
+    return clip.fps, clip.to_legacy()
 
-    frames = np.load(landmarks_path)
-    frames = _filter_useless(frames)
 
-    left_hand = frames[1]
-    right_hand = frames[2]
+def _load(landmarks_path: str) -> tuple[int, VecNxNxNx3]:
+    if landmarks_path.endswith(clip_extension):
+        clip = read_clip(landmarks_path)
+        return clip.fps, clip.to_legacy()
 
-    left_start_stop = _get_non_zero_indices(left_hand)
-    right_start_stop = _get_non_zero_indices(right_hand)
+    fps = int(re.search(r'__fps(\d+)\.npy', landmarks_path).group(1))
 
-    fps = int(re.search(r'__fps(\d+)\.npy', file).group(1))
+    return fps, np.load(landmarks_path)
 
-    _process(left_hand, fps, *left_start_stop)
-    _process(right_hand, fps, *right_start_stop)
+
+def _trim(fps: int, frames: VecNxNxNx3) -> tuple[int, VecNxNxNx3]:
+    return fps, _filter_useless(frames)
+
+
+def _kalman(fps: int, frames: VecNxNxNx3, steady_state: bool) -> tuple[int, VecNxNxNx3]:
+    # The input is a cached, read only, array
+    frames = frames.copy()
+
+    left_start_stop = _get_non_zero_indices(frames[1])
+    right_start_stop = _get_non_zero_indices(frames[2])
+
+    _process_hands(frames[1:3], fps, [left_start_stop, right_start_stop], steady_state)
 
     start = min(left_start_stop[0], right_start_stop[0])
     stop = max(left_start_stop[1], right_start_stop[1])
 
+    return fps, frames[:,start:stop]
+
+
+def _moving_average(fps: int, frames: VecNxNxNx3, window_size: int) -> tuple[int, VecNxNxNx3]:
     if window_size == 1:
-        frames = frames[:,start:stop]
+        return fps, frames
+
+    return fps, moving_average_smooth(frames, window_size)
+
+
+def _owner(frames: np.ndarray) -> np.ndarray:
+    # The array whose memory frames is a view of, frames itself if it owns its memory
+    while isinstance(frames.base, np.ndarray):
+        frames = frames.base
+
+    return frames
+
+
+class SmoothedCache:
+    """
+    LRU cache of (fps, landmarks) pairs, bounded by the total number of bytes of the cached arrays.
+
+    Stages may return views of their input, or their input itself, so the memory of an array
+    shared by several entries is only counted once, as long as any of them is cached.
+
+    Holds the output of every stage of get_smoothed, keyed by the stage, the landmarks path,
+    the file mtime and the parameters the stage depends on. A clip that is rewritten on disk
+    is thus processed again on its next use instead of being served stale.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, tuple[int, VecNxNxNx3]] = OrderedDict()
+        # id of an array owning memory -> (that array, number of entries holding it)
+        self._owners: dict[int, tuple[np.ndarray, int]] = {}
+        self._num_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> tuple[int, VecNxNxNx3] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry
+
+    def put(self, key: tuple, fps: int, frames: VecNxNxNx3) -> None:
+        # Handed out to every caller, so it must not be changed through any of them
+        frames.setflags(write=False)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._release(old[1])
+
+            # A clip bigger than the whole budget is returned, but never cached
+            if _owner(frames).nbytes > self.max_bytes:
+                return
+
+            self._entries[key] = (fps, frames)
+            self._hold(frames)
+
+            while self._num_bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._release(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._owners.clear()
+            self._num_bytes = 0
+
+    def _hold(self, frames: VecNxNxNx3) -> None:
+        owner = _owner(frames)
+        _, count = self._owners.get(id(owner), (owner, 0))
+
+        if count == 0:
+            self._num_bytes += owner.nbytes
+
+        self._owners[id(owner)] = (owner, count + 1)
+
+    def _release(self, frames: VecNxNxNx3) -> None:
+        owner = _owner(frames)
+        _, count = self._owners[id(owner)]
+
+        if count == 1:
+            del self._owners[id(owner)]
+            self._num_bytes -= owner.nbytes
+        else:
+            self._owners[id(owner)] = (owner, count - 1)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def num_bytes(self) -> int:
+        return self._num_bytes
+
+
+smoothed_cache = SmoothedCache(_smoothed_cache_max_bytes)
+
+
+def _cached_stage(key: tuple, timings: dict[str, float] | None, stage, *args) -> tuple[int, VecNxNxNx3]:
+    entry = smoothed_cache.get(key)
+    if entry is not None:
+        return entry
+
+    start = time.perf_counter()
+    fps, frames = stage(*args)
+
+    if timings is not None:
+        timings[key[0]] = timings.get(key[0], 0) + time.perf_counter() - start
+
+    smoothed_cache.put(key, fps, frames)
+
+    return fps, frames
+
+
+def get_smoothed(
+    directory: str,
+    word: str,
+    window_size: int,
+    steady_state: bool = False,
+    timings: dict[str, float] | None = None
+) -> tuple[int, VecNxNxNx3]:
+    """
+    Returns the fps and the smoothed (3, T, 33, 3) landmarks of word, without going through the disk.
+
+    With steady_state, the hands are Kalman filtered with the precomputed gains, which is faster
+    but may differ from the full filter in the last bits.
+
+    The returned array is shared with the cache and is read only. If timings is given, the seconds
+    spent in each stage that was not cached are added to it, by stage name.
+    """
+
+    source = _landmarks_source(directory, word)
+
+    # Each stage only reruns when its own parameters change, so e.g. a new window size
+    # costs a single moving average over the already Kalman filtered frames
+    if isinstance(source, LandmarkBundle):
+        key = (source.path, source.mtime_ns, word)
+        fps, frames = _cached_stage(('load', *key), timings, _load_from_bundle, source, word)
     else:
-        frames = [moving_average_smooth(value, window_size) for value in frames[:,start:stop]]
+        landmarks_path = source
+        key = (landmarks_path, os.stat(landmarks_path).st_mtime_ns)
+        fps, frames = _cached_stage(('load', *key), timings, _load, landmarks_path)
+
+    fps, frames = _cached_stage(('trim', *key), timings, _trim, fps, frames)
+    fps, frames = _cached_stage(('kalman', *key, steady_state), timings, _kalman, fps, frames, steady_state)
+    fps, frames = _cached_stage(
+        ('smooth', *key, steady_state, window_size), timings, _moving_average, fps, frames, window_size
+    )
+
+    return fps, frames
+
+
+def save_smoothed(
+    directory: str,
+    word: str,
+    window_size: int,
+    steady_state: bool = False
+) -> int:
+    """
+    Same as get_smoothed, but persists the landmarks to <word>_smooth.npy and only returns the fps.
+    """
+
+    fps, frames = get_smoothed(directory, word, window_size, steady_state)
 
     np.save(os.path.join(directory, f'{word}_smooth.npy'), frames)
 
-    return fps
\ No newline at end of file
+    return fps
+
+
+if __name__ == '__main__':
+
+    # test _hands_over_torso_mid, against np.dot frame by frame
+    def check_hands_over_torso_mid(pose, percentage):
+        mid_shoulders = (pose[11][:2] + pose[12][:2]) / 2
+        mid_hips = (pose[23][:2] + pose[24][:2]) / 2
+
+        spine_dir = mid_shoulders - mid_hips
+        spine_dir /= np.linalg.norm(spine_dir)
+
+        l_mid_torso = pose[11][:2] * percentage + pose[23][:2] * (1 - percentage)
+        r_mid_torso = pose[12][:2] * percentage + pose[24][:2] * (1 - percentage)
+
+        return np.dot(pose[15][:2], spine_dir) >= np.dot(l_mid_torso, spine_dir) or \
+            np.dot(pose[16][:2], spine_dir) >= np.dot(r_mid_torso, spine_dir)
+
+    rng = np.random.default_rng(0)
+
+    for dtype in [np.float64, np.float32]:
+        pose = rng.random((20000, 33, 3)).astype(dtype)
+        pose[:, [23, 24], 1] += 1
+
+        # The left hand within an ulp of the threshold, the right one well below it
+        l_mid_torso = pose[:, 11, :2] * 0.2 + pose[:, 23, :2] * 0.8
+        spine = pose[:, 11, :2] + pose[:, 12, :2] - pose[:, 23, :2] - pose[:, 24, :2]
+        across = np.stack([-spine[:, 1], spine[:, 0]], axis=-1)
+        pose[:, 15, :2] = l_mid_torso + across * rng.random((20000, 1)) + rng.normal(0, 1e-16, (20000, 2))
+        pose[:, 16, :2] = pose[:, 24, :2] + 1
+
+        expected = [check_hands_over_torso_mid(frame, 0.2) for frame in pose]
+        assert np.array_equal(_hands_over_torso_mid(pose, 0.2), expected)
@@ -7,7 +7,10 @@ Vec = Annotated[NDArray[np.float64], Literal["N"]]
 Vec3 = Annotated[NDArray[np.float64], Literal[3]]
 Vec4 = Annotated[NDArray[np.float64], Literal[4]]
 Mat4 = Annotated[NDArray[np.float64], Literal[4, 4]]
+MatNx4x4 = Annotated[NDArray[np.float64], Literal["N", 4, 4]]
 
 VecNx3 = Annotated[NDArray[np.float64], Literal["N", 3]]
 VecNx4 = Annotated[NDArray[np.float64], Literal["N", 4]]
-VecNxNx3 = Annotated[NDArray[np.float64], Literal["N", "N", 3]]
\ No newline at end of file
+VecNxNx3 = Annotated[NDArray[np.float64], Literal["N", "N", 3]]
+VecNxNx4 = Annotated[NDArray[np.float64], Literal["N", "N", 4]]
+VecNxNxNx3 = Annotated[NDArray[np.float64], Literal["N", "N", "N", 3]]
\ No newline at end of file
@@ -0,0 +1,181 @@
+import numpy as np
+import os
+import struct
+
+from .math_types import *
+
+
+# A rotation clip holds the (T, 41, 4) bone quaternions, (w, x, y, z), baked for a word from its
+# landmarks smoothed with a window size, for one character's rig. It is a 64 bytes header
+# followed by the quaternions, frame after frame, as float32 or float16.
+#
+# Header, little endian:
+#   magic, version, dtype (0 float32, 1 float16), fps, window size, number of bones,
+#   number of frames, digest of the rig the rotations were solved for, digest of the
+#   landmarks they were solved from.
+_magic = b'LSRT'
+_version = 2
+_header = struct.Struct('<4sHHHHHxxI16s16s')
+_header_size = 64
+
+dtypes = [np.dtype('<f4'), np.dtype('<f2')]
+
+num_bones = 41
+
+rotation_clip_extension = '.rot'
+
+
+class RotationClip:
+    """
+    A rotation clip read from a file, its quaternions still in their stored dtype and memory
+    mapped when possible.
+    """
+
+    def __init__(self, fps: int, window_size: int, rig_digest: bytes, landmarks_digest: str, data: np.ndarray):
+        self.fps = fps
+        self.window_size = window_size
+        self.rig_digest = rig_digest
+        self.landmarks_digest = landmarks_digest
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def rotations(self) -> VecNxNx4:
+        """
+        The (T, 41, 4) float32 quaternions, without a copy unless they are stored as float16.
+        """
+
+        if self.data.dtype == np.float32:
+            return self.data
+
+        return self.data.astype(np.float32)
+
+
+def rotation_clip_path(directory: str, word: str, window_size: int) -> str:
+    return os.path.join(directory, f'{word}__w{window_size}{rotation_clip_extension}')
+
+
+def write_rotation_clip(
+    path: str,
+    rotations: VecNxNx4,
+    fps: int,
+    window_size: int,
+    rig_digest: bytes,
+    landmarks_digest: str,
+    half: bool = False
+) -> None:
+    """
+    Writes the (T, 41, 4) rotations as a rotation clip, as float16 when half is set.
+
+    landmarks_digest is the landmarks_digest of the landmarks the rotations were solved from.
+    """
+
+    data = np.ascontiguousarray(rotations, dtype=dtypes[1 if half else 0])
+
+    header = _header.pack(
+        _magic,
+        _version,
+        1 if half else 0,
+        fps,
+        window_size,
+        data.shape[1],
+        len(data),
+        rig_digest,
+        bytes.fromhex(landmarks_digest)
+    )
+
+    with open(path, 'wb') as f:
+        f.write(header.ljust(_header_size, b'\0'))
+        f.write(data.tobytes())
+
+
+def read_rotation_clip(path: str, mmap: bool = True) -> RotationClip:
+    with open(path, 'rb') as f:
+        header = f.read(_header_size)
+
+    if len(header) != _header_size:
+        raise ValueError(f'{path} is not a rotation clip')
+
+    magic, version, dtype, fps, window_size, num_clip_bones, num_frames, rig_digest, landmarks_digest = \
+        _header.unpack(header[:_header.size])
+
+    if magic != _magic:
+        raise ValueError(f'{path} is not a rotation clip')
+
+    if version != _version:
+        raise ValueError(f'{path} is a version {version} rotation clip, only version {_version} is supported')
+
+    dtype = dtypes[dtype]
+    shape = (num_frames, num_clip_bones, 4)
+
+    if mmap and num_frames > 0:
+        data = np.memmap(path, dtype=dtype, mode='r', offset=_header_size, shape=shape)
+    else:
+        data = np.fromfile(path, dtype=dtype, offset=_header_size).reshape(shape)
+
+    return RotationClip(fps, window_size, rig_digest, landmarks_digest.hex(), data)
+
+
+def get_baked_rotations(
+    directory: str,
+    word: str,
+    window_size: int,
+    rig_digest: bytes | None = None,
+    landmarks_digest: str | None = None
+) -> tuple[int, VecNxNx4] | None:
+    """
+    Returns the fps and the float32 rotations baked for word and window_size in directory, or
+    None when there are none, or when they were baked for another rig than rig_digest's, or
+    from other landmarks than those of landmarks_digest, in which case the rotations are to be
+    solved from the landmarks instead.
+    """
+
+    try:
+        clip = read_rotation_clip(rotation_clip_path(directory, word, window_size))
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if rig_digest is not None and clip.rig_digest != bytes(rig_digest):
+        return None
+
+    if landmarks_digest is not None and clip.landmarks_digest != landmarks_digest:
+        return None
+
+    return clip.fps, clip.rotations()
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    rng = np.random.default_rng(0)
+
+    rotations = rng.random((40, num_bones, 4)) * 2 - 1
+    rotations[:, 3] = [0, 0, 0, 0.5]
+    digest = bytes(range(16))
+    landmarks = 'f' * 32
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = rotation_clip_path(directory, 'casă', 5)
+        write_rotation_clip(path, rotations, 30, 5, digest, landmarks)
+        clip = read_rotation_clip(path)
+
+        assert clip.fps == 30 and clip.window_size == 5 and clip.rig_digest == digest and len(clip) == 40
+        assert clip.landmarks_digest == landmarks
+        assert isinstance(clip.data, np.memmap)
+        assert np.array_equal(clip.rotations(), rotations.astype(np.float32))
+
+        write_rotation_clip(path, rotations, 30, 5, digest, landmarks, half=True)
+        assert os.path.getsize(path) == _header_size + 40 * num_bones * 4 * 2
+
+        fps, baked = get_baked_rotations(directory, 'casă', 5, digest, landmarks)
+        assert fps == 30 and baked.dtype == np.float32
+        assert np.allclose(baked, rotations, atol=1e-3)
+        # The null rotations stay exact
+        assert np.array_equal(baked[:, 3], rotations[:, 3])
+
+        assert get_baked_rotations(directory, 'casă', 5, bytes(16)) is None
+        # Baked from landmarks that have changed since
+        assert get_baked_rotations(directory, 'casă', 5, digest, '0' * 32) is None
+        assert get_baked_rotations(directory, 'casă', 7) is None
+        assert get_baked_rotations(directory, 'eu', 5) is None
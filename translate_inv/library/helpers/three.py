@@ -187,8 +187,223 @@ def R_from_Q(quat: Vec4) -> Mat4:
     return compose_mat(np.zeros(3), quat)
 
 
+# Batched variants.
+# Same math as above, but over stacks of vectors (..., 3), quaternions (..., 4)
+# and matrices (..., 4, 4), broadcasting along the leading axes.
+
+
+def unproject_batch(v: VecNx3) -> VecNx3:
+    v = apply_matrix_4_batch(v, projection_matrix_inverse)
+    v = apply_matrix_4_batch(v, matrix_world)
+    return v
+
+
+def mult_mat_batch(a: MatNx4x4, b: MatNx4x4) -> MatNx4x4:
+    return b @ a
+
+
+def normalize_batch(v: NDArray[np.float64]) -> NDArray[np.float64]:
+    len_v = np.linalg.norm(v, axis=-1, keepdims=True)
+    result = np.zeros(np.broadcast_shapes(v.shape, len_v.shape))
+
+    return np.divide(v, len_v, out=result, where=len_v != 0)
+
+
+def apply_matrix_4_batch(v: VecNx3, m: MatNx4x4) -> VecNx3:
+    # m^T @ [v, 1], without building the homogeneous vectors
+    result = (v[..., np.newaxis, :] @ m[..., :3, :])[..., 0, :] + m[..., 3, :]
+
+    return result[..., :3] / result[..., 3:]
+
+
+def make_basis_batch(x_axis: VecNx3, y_axis: VecNx3, z_axis: VecNx3) -> MatNx4x4:
+    shape = np.broadcast_shapes(x_axis.shape, y_axis.shape, z_axis.shape)[:-1]
+
+    m = np.zeros(shape + (4, 4))
+    m[..., 0, :3] = x_axis
+    m[..., 1, :3] = y_axis
+    m[..., 2, :3] = z_axis
+    m[..., 3, 3] = 1
+
+    return m
+
+
+def Q_from_R_batch(m: MatNx4x4) -> VecNx4:
+    m11, m12, m13 = m[..., 0, 0], m[..., 1, 0], m[..., 2, 0]
+    m21, m22, m23 = m[..., 0, 1], m[..., 1, 1], m[..., 2, 1]
+    m31, m32, m33 = m[..., 0, 2], m[..., 1, 2], m[..., 2, 2]
+
+    trace = m11 + m22 + m33
+
+    # Same branch selection as Q_from_R, evaluated per matrix
+    b0 = trace > 0
+    b1 = ~b0 & (m11 > m22) & (m11 > m33)
+    b2 = ~(b0 | b1) & (m22 > m33)
+    b3 = ~(b0 | b1 | b2)
+
+    result = np.empty(m.shape[:-2] + (4,))
+
+    s = 0.5 / np.sqrt(trace[b0] + 1)
+    result[b0] = np.stack((
+        0.25 / s,
+        (m32[b0] - m23[b0]) * s,
+        (m13[b0] - m31[b0]) * s,
+        (m21[b0] - m12[b0]) * s
+    ), axis=-1)
+
+    s = 2 * np.sqrt(1 + m11[b1] - m22[b1] - m33[b1])
+    result[b1] = np.stack((
+        (m32[b1] - m23[b1]) / s,
+        0.25 * s,
+        (m12[b1] + m21[b1]) / s,
+        (m13[b1] + m31[b1]) / s
+    ), axis=-1)
+
+    s = 2 * np.sqrt(1 + m22[b2] - m11[b2] - m33[b2])
+    result[b2] = np.stack((
+        (m13[b2] - m31[b2]) / s,
+        (m12[b2] + m21[b2]) / s,
+        0.25 * s,
+        (m23[b2] + m32[b2]) / s
+    ), axis=-1)
+
+    s = 2 * np.sqrt(1 + m33[b3] - m11[b3] - m22[b3])
+    result[b3] = np.stack((
+        (m21[b3] - m12[b3]) / s,
+        (m13[b3] + m31[b3]) / s,
+        (m23[b3] + m32[b3]) / s,
+        0.25 * s
+    ), axis=-1)
+
+    return result
+
+
+def slerp_batch(qa: VecNx4, qb: VecNx4, t: float) -> VecNx4:
+    if t == 0:
+        return qa
+    if t == 1:
+        return qb
+
+    qa, qb = np.broadcast_arrays(qa, qb)
+
+    cos_half_theta = np.sum(qa * qb, axis=-1)
+
+    flip = cos_half_theta < 0
+    qb = np.where(flip[..., np.newaxis], -qb, qb)
+    cos_half_theta = np.where(flip, -cos_half_theta, cos_half_theta)
+
+    result = np.empty(qa.shape)
+
+    same = cos_half_theta >= 1
+    result[same] = qa[same]
+
+    sqr_sin_half_theta = 1 - cos_half_theta * cos_half_theta
+    close = ~same & (sqr_sin_half_theta <= np.finfo(float).eps)
+    s = 1 - t
+    result[close] = normalize_batch(s * qa[close] + t * qb[close])
+
+    rest = ~(same | close)
+    sin_half_theta = np.sqrt(sqr_sin_half_theta[rest])
+    half_theta = np.arctan2(sin_half_theta, cos_half_theta[rest])
+    ratio_a = np.sin((1 - t) * half_theta) / sin_half_theta
+    ratio_b = np.sin(t * half_theta) / sin_half_theta
+    result[rest] = ratio_a[:, np.newaxis] * qa[rest] + ratio_b[:, np.newaxis] * qb[rest]
+
+    return result
+
+
+def compose_mat_batch(pos: VecNx3, Q: VecNx4, scale: VecNx3 = np.ones(3)) -> MatNx4x4:
+    w, x, y, z = np.moveaxis(Q, -1, 0)
+    x2, y2, z2 = x + x,  y + y,  z + z
+    xx, xy, xz = x * x2, x * y2, x * z2
+    yy, yz, zz = y * y2, y * z2, z * z2
+    wx, wy, wz = w * x2, w * y2, w * z2
+
+    sx, sy, sz = np.moveaxis(scale, -1, 0)
+
+    shape = np.broadcast_shapes(pos.shape[:-1], Q.shape[:-1], scale.shape[:-1])
+
+    m = np.empty(shape + (4, 4))
+    m[..., 0, 0] = (1 - (yy + zz)) * sx
+    m[..., 0, 1] = (xy + wz) * sx
+    m[..., 0, 2] = (xz - wy) * sx
+    m[..., 0, 3] = 0
+    m[..., 1, 0] = (xy - wz) * sy
+    m[..., 1, 1] = (1 - (xx + zz)) * sy
+    m[..., 1, 2] = (yz + wx) * sy
+    m[..., 1, 3] = 0
+    m[..., 2, 0] = (xz + wy) * sz
+    m[..., 2, 1] = (yz - wx) * sz
+    m[..., 2, 2] = (1 - (xx + yy)) * sz
+    m[..., 2, 3] = 0
+    m[..., 3, :3] = pos
+    m[..., 3, 3] = 1
+
+    return m
+
+
+def decompose_mat_batch(m: MatNx4x4) -> tuple[VecNx3, VecNx4, VecNx3]:
+    sx = np.linalg.norm(m[..., 0, :3], axis=-1)
+    sy = np.linalg.norm(m[..., 1, :3], axis=-1)
+    sz = np.linalg.norm(m[..., 2, :3], axis=-1)
+
+    sx = np.where(np.linalg.det(m) < 0, -sx, sx)
+
+    translation = m[..., 3, :3]
+
+    scale = np.stack((sx, sy, sz), axis=-1)
+
+    r = np.zeros(m.shape)
+    r[..., :3, :3] = m[..., :3, :3] / scale[..., :, np.newaxis]
+
+    quaternion = Q_from_R_batch(r)
+
+    return (translation, quaternion, scale)
+
+
+def extract_R_batch(m: MatNx4x4) -> MatNx4x4:
+    scale = 1 / np.linalg.norm(m[..., :3, :3], axis=-1)
+
+    r = np.zeros(m.shape)
+    r[..., :3, :3] = m[..., :3, :3] * scale[..., :, np.newaxis]
+    r[..., 3, 3] = 1
+
+    return r
+
+
+def R_from_Q_batch(quat: VecNx4) -> MatNx4x4:
+    return compose_mat_batch(np.zeros(3), quat)
+
+
 if __name__ == '__main__':
 
+    rng = np.random.default_rng(0)
+
+    def random_vectors(n: int, dim: int = 3) -> NDArray[np.float64]:
+        return rng.normal(size=(n, dim)) * 10
+
+    def random_quaternions(n: int) -> VecNx4:
+        return normalize_batch(rng.normal(size=(n, 4)))
+
+    def assert_parity(batch_fn, scalar_fn, *stacks) -> None:
+        # batch_fn over whole stacks must match scalar_fn applied element by element
+        result = batch_fn(*stacks)
+        expected = np.array([scalar_fn(*args) for args in zip(*stacks)])
+        assert(result.shape == expected.shape)
+        assert(np.allclose(expected, result))
+
+        # and a single (unstacked) element must keep its shape
+        single = batch_fn(*(stack[0] for stack in stacks))
+        assert(np.allclose(expected[0], single))
+
+
+    # test normalize
+    v = np.concatenate((random_vectors(16), np.zeros((1, 3))))
+    assert_parity(normalize_batch, normalize, v)
+    assert((normalize_batch(np.zeros((2, 5, 3))) == 0).all())
+    assert(normalize_batch(random_vectors(6).reshape(2, 3, 3)).shape == (2, 3, 3))
+
+
     # test apply_matrix_4
     v = np.array([1, 2, 3])
     m = new_mat(
@@ -201,6 +416,17 @@ if __name__ == '__main__':
     expected = np.array([0.3170731707317074, 0.5447154471544716, 0.7723577235772359])
     assert(np.allclose(expected, result))
 
+    vs = random_vectors(16)
+    ms = np.array([compose_mat(p, q) for p, q in zip(random_vectors(16), random_quaternions(16))])
+    assert_parity(apply_matrix_4_batch, apply_matrix_4, vs, ms)
+    assert(np.allclose(apply_matrix_4_batch(vs, m), [apply_matrix_4(x, m) for x in vs]))
+
+
+    # test mult_mat
+    a = np.array([new_mat(*rng.normal(size=16)) for _ in range(16)])
+    b = np.array([new_mat(*rng.normal(size=16)) for _ in range(16)])
+    assert_parity(mult_mat_batch, mult_mat, a, b)
+
 
     # test make_basis
     u = np.array([1, 2, 3])
@@ -215,6 +441,8 @@ if __name__ == '__main__':
     ])
     assert((expected == result).all())
 
+    assert_parity(make_basis_batch, make_basis, random_vectors(16), random_vectors(16), random_vectors(16))
+
 
     # test Q_from_R
     identity = np.eye(4)
@@ -263,6 +491,26 @@ if __name__ == '__main__':
     for t, e in zip(test_matrices, expected):
         assert((e == Q_from_R(t)).all())
 
+    rotation_y_180 = new_mat(
+         np.cos(np.pi), 0, np.sin(np.pi), 0,
+         0,             1, 0,             0,
+        -np.sin(np.pi), 0, np.cos(np.pi), 0,
+         0,             0, 0,             1
+    )
+
+    rotation_z_180 = new_mat(
+        np.cos(np.pi), -np.sin(np.pi), 0, 0,
+        np.sin(np.pi),  np.cos(np.pi), 0, 0,
+        0,              0,             1, 0,
+        0,              0,             0, 1
+    )
+
+    # One stack covering all four branches
+    random_rotations = [R_from_Q(q) for q in random_quaternions(32)]
+    test_matrices = np.array(test_matrices + [rotation_y_180, rotation_z_180] + random_rotations)
+    assert_parity(Q_from_R_batch, Q_from_R, test_matrices)
+    assert(Q_from_R_batch(test_matrices.reshape(4, 10, 4, 4)).shape == (4, 10, 4))
+
     
     # test slerp
     qa = np.array([1, 2, 3, 4])
@@ -290,6 +538,24 @@ if __name__ == '__main__':
     qb = np.array([0.7071068, 0.7071068 + np.finfo(float).eps, np.finfo(float).eps, 0])
     assert((slerp(qa, qb, 0.5) == np.array([0.7071068, 0.7071068, 0, 0])).all())
 
+    # The edge cases above, stacked with random pairs
+    qas = np.concatenate((
+        np.array([[1, 0, 0, 0], [1, 0, 0, 0], [0.7071068, 0, 0, 0.7071068], [1, 0, 0, 0], [0.7071068, 0.7071068, 0, 0]]),
+        random_quaternions(16)
+    ))
+    qbs = np.concatenate((
+        np.array([
+            [-1, 0, 0, 0],
+            [1, 0, 0, 0],
+            [0, 0, 0.7071068, 0.7071068],
+            [1 - np.finfo(float).eps, 0, np.finfo(float).eps, 0],
+            [0.7071068, 0.7071068 + np.finfo(float).eps, np.finfo(float).eps, 0]
+        ]),
+        random_quaternions(16)
+    ))
+    for t in [0, 0.25, 1 / 3, 0.5, 1]:
+        assert_parity(lambda a, b: slerp_batch(a, b, t), lambda a, b: slerp(a, b, t), qas, qbs)
+
 
     # test compose_mat
     pos = np.array([0, 103.99147034, 2.07609391])
@@ -303,6 +569,12 @@ if __name__ == '__main__':
     ])
     assert(np.allclose(expected, result))
 
+    positions = random_vectors(16)
+    quaternions = random_quaternions(16)
+    scales = np.abs(random_vectors(16)) + 0.1
+    assert_parity(compose_mat_batch, compose_mat, positions, quaternions, scales)
+    assert_parity(compose_mat_batch, compose_mat, positions, quaternions)
+
 
     # test decompose_mat
     m = new_mat(1,2,3,4, 5,6,7,8, 9,10,11,12, 13,14,15,16)
@@ -313,6 +585,16 @@ if __name__ == '__main__':
     assert(np.allclose(expected_p, p))
     assert(np.allclose(expected_q, q))
     assert(np.allclose(expected_s, s))
+
+    ms = np.concatenate((
+        [m],
+        compose_mat_batch(positions, quaternions, scales),
+        compose_mat_batch(positions, quaternions, scales * np.array([-1, 1, 1]))
+    ))
+    ps, qs, ss = decompose_mat_batch(ms)
+    for i, x in enumerate(ms):
+        p, q, s = decompose_mat(x)
+        assert(np.allclose(p, ps[i]) and np.allclose(q, qs[i]) and np.allclose(s, ss[i]))
     
 
     # test extract_R
@@ -326,7 +608,9 @@ if __name__ == '__main__':
         [0.01599422977498581, -0.18160966163283088,   0.983240619286812,    0],
         [0,                    0,                     0,                    1]
     ])
-    assert((expected == result).all())
+    assert(np.allclose(expected, result))
+
+    assert_parity(extract_R_batch, extract_R, compose_mat_batch(positions, quaternions, scales))
     
 
     # test R_from_Q
@@ -340,9 +624,14 @@ if __name__ == '__main__':
     ])
     assert(np.allclose(expected, result))
 
+    assert_parity(R_from_Q_batch, R_from_Q, quaternions)
+
 
     # test unproject
     v = np.array([13.76, 23.41, 31.89])
+    assert_parity(unproject_batch, unproject, np.concatenate(([v], random_vectors(16))))
+
     result = unproject(v)
-    expected =  np.array([-0.4925567013678026, 0.3715069560853783, 3.0648148838306635])
-    assert((expected == result).all())
\ No newline at end of file
+    # The camera is at z = 1.75, so the view space z of 0.0648 ends up at 1.8148
+    expected =  np.array([-0.4925567013678026, 0.3715069560853783, 1.8148148838306633])
+    assert(np.allclose(expected, result))